@@ -0,0 +1,143 @@
+"""
+Micro-batching of Groq requests for high-volume channels.
+In configured channels, requests are collected for a short window (or
+until a batch fills up), identical requests in the window are merged,
+and the batch is dispatched concurrently through a bounded pipeline.
+Each waiting handler gets its own result back.
+"""
+
+import asyncio
+import contextvars
+import os
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import metrics
+
+# Comma-separated channel ids, or "*" for every channel
+BATCH_CHANNELS = os.getenv("BATCH_CHANNELS", "")
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "30"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "16"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+Job = Callable[[], Awaitable[Any]]
+
+batch_sizes = metrics.Histogram(
+    "bot_batch_size", "Requests per dispatched micro-batch", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+batch_merged = metrics.Counter("bot_batch_merged_total", "Requests answered by an identical request in the same batch")
+
+
+@dataclass
+class _Batch:
+    jobs: Dict[str, Job] = field(default_factory=dict)
+    # The context each job was submitted from, so its deadline and usage attribution follow it
+    contexts: Dict[str, contextvars.Context] = field(default_factory=dict)
+    waiters: Dict[str, List[asyncio.Future]] = field(default_factory=dict)
+    timer: Optional[asyncio.TimerHandle] = None
+
+    def __len__(self) -> int:
+        return sum(len(futures) for futures in self.waiters.values())
+
+
+class MicroBatcher:
+    """
+    Collects requests per channel and dispatches them in concurrent batches.
+    """
+
+    def __init__(
+        self,
+        channels: str = BATCH_CHANNELS,
+        window_ms: float = BATCH_WINDOW_MS,
+        max_items: int = BATCH_MAX_ITEMS,
+        concurrency: int = BATCH_CONCURRENCY,
+    ) -> None:
+        self.all_channels = channels.strip() == "*"
+        self.channels: Set[int] = set()
+        if not self.all_channels:
+            self.channels = {int(c) for c in channels.split(",") if c.strip()}
+        self.window = window_ms / 1000
+        self.max_items = max_items
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._concurrency = concurrency
+        self._batches: Dict[int, _Batch] = {}
+        self._dispatching: Set[asyncio.Task] = set()
+
+    def enabled_for(self, channel_id: Optional[int]) -> bool:
+        return channel_id is not None and (self.all_channels or channel_id in self.channels)
+
+    def set_channel_enabled(self, channel_id: int, enabled: bool) -> None:
+        if enabled:
+            self.channels.add(channel_id)
+        else:
+            self.channels.discard(channel_id)
+
+    async def submit(self, channel_id: int, key: str, job: Job) -> Any:
+        """
+        Queue a job in the channel's current batch and wait for its result.
+        Jobs with the same key in one batch run once and share the result.
+        The job runs in the caller's context (deadline, usage attribution),
+        not the timer's.
+        """
+        batch = self._batches.get(channel_id)
+        if batch is None:
+            batch = self._batches[channel_id] = _Batch()
+            loop = asyncio.get_running_loop()
+            batch.timer = loop.call_later(self.window, self._flush, channel_id)
+
+        future = asyncio.get_running_loop().create_future()
+        if key in batch.jobs:
+            # The first submitter's call answers everyone, so it runs on their deadline and
+            # is billed to them; later identical requests cost nothing
+            batch_merged.inc()
+        else:
+            batch.jobs[key] = job
+            batch.contexts[key] = contextvars.copy_context()
+        batch.waiters.setdefault(key, []).append(future)
+
+        if len(batch) >= self.max_items:
+            self._flush(channel_id)
+        return await future
+
+    def _flush(self, channel_id: int) -> None:
+        batch = self._batches.pop(channel_id, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        batch_sizes.observe(len(batch))
+        task = asyncio.create_task(self._dispatch(batch))
+        self._dispatching.add(task)
+        task.add_done_callback(self._dispatching.discard)
+
+    async def _dispatch(self, batch: _Batch) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def run(key: str, job: Job) -> None:
+            result: Any = None
+            error: Optional[BaseException] = None
+            finished = False
+            try:
+                async with self._semaphore:
+                    # Tasks copy the context current at creation, so create it inside the submitter's
+                    result = await batch.contexts[key].run(asyncio.create_task, job())
+                finished = True
+            except Exception as e:
+                error = e
+            finally:
+                # Every waiter gets an outcome; if the job was cancelled, so are they
+                for future in batch.waiters[key]:
+                    if future.done():
+                        continue
+                    if finished:
+                        future.set_result(result)
+                    elif error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.cancel()
+
+        await asyncio.gather(*(run(key, job) for key, job in batch.jobs.items()))
+
+
+batcher = MicroBatcher()
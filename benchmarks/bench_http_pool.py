@@ -0,0 +1,99 @@
+"""
+Benchmark: per-request HTTP sessions vs the shared connection pool.
+
+By default a local aiohttp server is started so the numbers only reflect
+connection setup overhead. Pass --url to measure against a real host
+(e.g. a Discord CDN attachment) and include TLS handshakes.
+
+    python benchmarks/bench_http_pool.py
+    python benchmarks/bench_http_pool.py --url https://cdn.discordapp.com/... -n 50
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import Awaitable, Callable, List
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import http_pool  # noqa: E402
+
+
+async def _start_local_server() -> web.AppRunner:
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response(body=b"x" * 64 * 1024, content_type="image/png")
+
+    app = web.Application()
+    app.router.add_get("/image.png", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner
+
+
+async def _time_requests(n: int, fetch: Callable[[], Awaitable[None]]) -> List[float]:
+    timings = []
+    for _ in range(n):
+        start = time.perf_counter()
+        await fetch()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def _report(name: str, timings: List[float]) -> None:
+    ordered = sorted(timings)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(
+        f"{name:<14} mean={statistics.mean(timings):7.2f}ms "
+        f"p50={statistics.median(timings):7.2f}ms p95={p95:7.2f}ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", help="URL to fetch (defaults to a local server)")
+    parser.add_argument("-n", type=int, default=200, help="requests per mode")
+    args = parser.parse_args()
+
+    runner = None
+    url = args.url
+    if url is None:
+        runner = await _start_local_server()
+        port = runner.addresses[0][1]
+        url = f"http://127.0.0.1:{port}/image.png"
+
+    async def fresh_session() -> None:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                await response.read()
+
+    pooled = http_pool.create_session()
+
+    async def pooled_session() -> None:
+        async with pooled.get(url) as response:
+            await response.read()
+
+    try:
+        fresh = await _time_requests(args.n, fresh_session)
+        shared = await _time_requests(args.n, pooled_session)
+    finally:
+        await pooled.close()
+        if runner is not None:
+            await runner.cleanup()
+
+    print(f"{args.n} requests to {url}")
+    _report("fresh session", fresh)
+    _report("shared pool", shared)
+    saved = statistics.mean(fresh) - statistics.mean(shared)
+    print(f"saved per request: {saved:.2f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
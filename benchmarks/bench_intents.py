@@ -0,0 +1,142 @@
+"""
+Benchmark: per-event CPU cost of classifying gateway messages.
+
+Replays a synthetic message mix (mostly chatter that doesn't mention the
+bot, plus mentions, weather questions and image attachments) through the
+precompiled intent router and through the previous per-message logic
+(string replace, re.compile on every mention, a second attachment scan),
+and reports the cost per event and the message rate one core sustains.
+
+    python benchmarks/bench_intents.py
+    python benchmarks/bench_intents.py --events 500000 --mention-ratio 0.2
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from image_index import image_urls  # noqa: E402
+from intents import IntentRouter  # noqa: E402
+
+BOT_ID = 1234567890123456789
+
+_CHATTER = [
+    "lol that was great",
+    "anyone up for a game tonight?",
+    "brb",
+    "I think the patch notes are out, check #announcements",
+    "```py\nprint('hello')\n```",
+    "did you see the match yesterday? absolutely wild ending",
+]
+_QUESTIONS = [
+    "what's the capital of France?",
+    "explain how transformers work in simple terms",
+    "what's the weather in Bangkok, Tokyo, London?",
+    "weather in Paris",
+    "can you describe this picture?",
+    "",
+]
+
+
+def _attachment(image: bool) -> Any:
+    return SimpleNamespace(
+        url="https://cdn.discordapp.com/attachments/1/2/file.png",
+        media_type="image/png" if image else "application/pdf",
+    )
+
+
+def make_messages(count: int, mention_ratio: float, attachment_ratio: float, seed: int = 1) -> List[Any]:
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        mention = rng.random() < mention_ratio
+        text = rng.choice(_QUESTIONS) if mention else rng.choice(_CHATTER)
+        content = f"<@{BOT_ID}> {text}" if mention else text
+        attachments = [_attachment(rng.random() < 0.8)] if rng.random() < attachment_ratio else []
+        messages.append(SimpleNamespace(
+            content=content,
+            user_mentions_ids=[BOT_ID] if mention else [],
+            attachments=attachments,
+        ))
+    return messages
+
+
+def legacy(message: Any) -> Any:
+    """
+    The handler's old classification path, for comparison.
+    """
+    image_urls(message) if message.attachments else None  # image index scan
+    if not message.content:
+        return None
+    content = message.content
+    if BOT_ID in message.user_mentions_ids:
+        question = content.replace(f"<@{BOT_ID}>", "").strip()
+        if not question:
+            return "greeting"
+        weather_pattern = re.compile(r'weather\s+in\s+([a-zA-Z\s,]+)', re.IGNORECASE)
+        weather_match = weather_pattern.search(question)
+        if weather_match:
+            locations = [loc.strip() for loc in weather_match.group(1).split(",") if loc.strip()]
+            if locations:
+                return ("weather", locations)
+        return ("chat", image_urls(message))
+    return None
+
+
+def router_path(router: IntentRouter) -> Callable[[Any], Any]:
+    """
+    The handler's current path: one attachment scan, then the intent router.
+    """
+    classify = router.classify
+
+    def handle(message: Any) -> Any:
+        return classify(message, image_urls(message) if message.attachments else ())
+    return handle
+
+
+def measure(name: str, classify: Callable[[Any], Any], messages: List[Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for message in messages:
+            classify(message)
+        best = min(best, time.perf_counter() - started)
+    per_event = best / len(messages)
+    print(f"{name:10s} {per_event * 1e9:8.0f} ns/event   {1 / per_event:12,.0f} events/s per core")
+    return per_event
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument("--mention-ratio", type=float, default=0.05)
+    parser.add_argument("--attachment-ratio", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    messages = make_messages(args.events, args.mention_ratio, args.attachment_ratio)
+    router = IntentRouter()
+    router.set_bot_id(BOT_ID)
+
+    print(f"{args.events} events, {args.mention_ratio:.0%} mentions, {args.attachment_ratio:.0%} with attachments")
+    before = measure("legacy", legacy, messages, args.repeat)
+    after = measure("router", router_path(router), messages, args.repeat)
+    print(f"speed-up   {before / after:8.2f}x")
+
+    mentions = [m for m in messages if m.user_mentions_ids]
+    if mentions:
+        print(f"\nMentions only ({len(mentions)} events)")
+        before = measure("legacy", legacy, mentions, args.repeat)
+        after = measure("router", router_path(router), mentions, args.repeat)
+        print(f"speed-up   {before / after:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
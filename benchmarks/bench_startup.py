@@ -0,0 +1,119 @@
+"""
+Benchmark: bot startup time.
+
+Import time is measured offline by importing bot.py in fresh interpreters,
+with a per-module breakdown from `python -X importtime`. With a Discord
+token, the bot is also started with EXIT_ON_READY=1 to time process start
+to gateway READY.
+
+    python benchmarks/bench_startup.py -n 5
+    python benchmarks/bench_startup.py --gateway    # needs DISCORD_API_KEY
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Heavy modules that should no longer be imported before the gateway is ready
+DEFERRED_MODULES = ("pydantic_ai", "logfire", "groq", "tiktoken", "PIL", "weather_agent")
+
+
+def _env() -> Dict[str, str]:
+    return {**os.environ, "METRICS_PORT": "0", "PYTHONDONTWRITEBYTECODE": "1"}
+
+
+def _parse_importtime(stderr: str) -> Tuple[Dict[str, int], List[str]]:
+    """
+    Cumulative microseconds per top-level import, and every module imported.
+    """
+    top_level: Dict[str, int] = {}
+    modules: List[str] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        modules.append(name)
+        raw_name = line.rsplit("|", 1)[1]
+        # Top-level imports are indented by a single space
+        if not raw_name.startswith("  "):
+            top_level[name] = int(cumulative)
+    return top_level, modules
+
+
+def bench_imports(runs: int) -> None:
+    walls = []
+    top_level: Dict[str, int] = {}
+    modules: List[str] = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import bot"],
+            cwd=ROOT, env=_env(), capture_output=True, text=True,
+        )
+        walls.append(time.perf_counter() - started)
+        if result.returncode != 0:
+            print(result.stderr[-2000:])
+            raise SystemExit("Importing bot failed")
+        top_level, modules = _parse_importtime(result.stderr)
+
+    print(f"python -c 'import bot' over {runs} runs")
+    print(f"  median {statistics.median(walls) * 1000:7.0f} ms   min {min(walls) * 1000:7.0f} ms")
+    print("  slowest top-level imports (cumulative):")
+    for name, micros in sorted(top_level.items(), key=lambda item: -item[1])[:10]:
+        print(f"    {micros / 1000:7.1f} ms  {name}")
+    imported = {name.split(".")[0] for name in modules}
+    for name in DEFERRED_MODULES:
+        print(f"  {name:15s} {'imported at startup' if name in imported else 'deferred'}")
+
+
+def bench_gateway(runs: int, timeout: float) -> None:
+    if not os.getenv("DISCORD_API_KEY"):
+        raise SystemExit("--gateway needs DISCORD_API_KEY (the bot really connects to Discord)")
+    readies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "bot.py"],
+            cwd=ROOT, env={**_env(), "EXIT_ON_READY": "1"},
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        )
+        ready = None
+        assert process.stdout is not None
+        for line in process.stdout:
+            if "Gateway ready" in line:
+                ready = time.perf_counter() - started
+                break
+            if time.perf_counter() - started > timeout:
+                break
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if ready is None:
+            raise SystemExit("The bot didn't report gateway ready")
+        readies.append(ready)
+
+    print(f"Process start to gateway READY over {runs} runs")
+    print(f"  median {statistics.median(readies) * 1000:7.0f} ms   min {min(readies) * 1000:7.0f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument("--gateway", action="store_true", help="Also time process start to gateway READY")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    bench_imports(args.runs)
+    if args.gateway:
+        bench_gateway(args.runs, args.timeout)
+
+
+if __name__ == "__main__":
+    main()
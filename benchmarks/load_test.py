@@ -0,0 +1,366 @@
+"""
+Offline load test for the bot's message handlers.
+
+Starts the local API stand-ins from mock_servers.py, points the bot at them,
+and replays a synthetic mix of gateway events (mentions with and without
+images, weather questions, prefix commands) at a target rate against
+`on_message_create` and the command callbacks. Discord itself is replaced
+by in-memory fakes, so only the bot's own work and the mocked upstream
+latencies are measured.
+
+    python benchmarks/load_test.py --rate 20 --duration 30
+    python benchmarks/load_test.py --rate 50 --duration 10 --json results.json --max-p95-ms 2500
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import mock_servers  # noqa: E402
+
+BOT_USER_ID = 1000
+MESSAGE_MIX = {
+    "mention": 0.50,
+    "mention_image": 0.15,
+    "mention_weather": 0.15,
+    "groq_command": 0.10,
+    "weather_command": 0.05,
+    "vision_command": 0.05,
+}
+QUESTIONS = [
+    "what is the capital of france",
+    "explain quantum computing simply",
+    "recommend a spicy thai dish",
+    "how do vaccines work",
+    "write a haiku about discord bots",
+]
+CITIES = ["Bangkok", "Tokyo", "London", "Paris", "New York", "Chiang Mai", "Berlin"]
+
+
+@dataclass
+class Sample:
+    kind: str
+    started: float
+    first_send: Optional[float] = None
+    finished: Optional[float] = None
+    sends: int = 0
+    busy: bool = False
+    error: Optional[str] = None
+
+
+@dataclass
+class FakeSentMessage:
+    sample: Sample
+    discord_latency: float
+
+    async def edit(self, content: str) -> "FakeSentMessage":
+        await asyncio.sleep(self.discord_latency)
+        self.sample.sends += 1
+        return self
+
+
+def _responder(sample: Sample, discord_latency: float):
+    async def respond(content: Any = None, **kwargs: Any) -> FakeSentMessage:
+        await asyncio.sleep(discord_latency)
+        if sample.first_send is None:
+            sample.first_send = time.perf_counter()
+        sample.sends += 1
+        if isinstance(content, str) and content.startswith("I'm handling a lot"):
+            sample.busy = True
+        return FakeSentMessage(sample, discord_latency)
+    return respond
+
+
+class FakeRest:
+    """The few REST calls the handlers make, with a fixed latency."""
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.calls = 0
+
+    async def trigger_typing(self, channel_id: int) -> None:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+
+    def fetch_messages(self, channel_id: int) -> Any:
+        rest = self
+
+        class _History:
+            def limit(self, n: int) -> "_History":
+                return self
+
+            def __aiter__(self) -> "_History":
+                return self
+
+            async def __anext__(self) -> Any:
+                rest.calls += 1
+                await asyncio.sleep(rest.latency)
+                raise StopAsyncIteration
+
+        return _History()
+
+
+class EventFactory:
+    """Builds synthetic gateway events and command contexts."""
+
+    def __init__(
+        self,
+        bot_module: Any,
+        base_url: str,
+        users: int,
+        guilds: int,
+        repeat_ratio: float,
+        discord_latency: float,
+    ) -> None:
+        self.bot_module = bot_module
+        self.base_url = base_url
+        self.users = users
+        self.guilds = guilds
+        self.repeat_ratio = repeat_ratio
+        self.discord_latency = discord_latency
+        self.ids = itertools.count(10_000)
+
+    def _question(self) -> str:
+        question = random.choice(QUESTIONS)
+        if random.random() >= self.repeat_ratio:
+            # Make most prompts unique so the response cache doesn't hide Groq latency
+            question += f" (variant {next(self.ids)})"
+        return question
+
+    def _image(self, message_id: int) -> Any:
+        return SimpleNamespace(
+            url=f"{self.base_url}/attachments/1/{message_id}/image.png?ex=1&hm=2",
+            media_type="image/png",
+        )
+
+    def event(self, kind: str, sample: Sample) -> Any:
+        message_id = next(self.ids)
+        user_id = random.randrange(self.users) + 1
+        guild_id = random.randrange(self.guilds) + 1
+        channel_id = guild_id * 100 + random.randrange(3)
+        attachments: List[Any] = []
+        if kind == "mention_weather":
+            cities = ", ".join(random.sample(CITIES, random.randint(1, 3)))
+            content = f"<@{BOT_USER_ID}> what's the weather in {cities}"
+        else:
+            content = f"<@{BOT_USER_ID}> {self._question()}"
+            if kind == "mention_image":
+                attachments = [self._image(message_id)]
+        message = SimpleNamespace(
+            id=message_id,
+            channel_id=channel_id,
+            guild_id=guild_id,
+            author=SimpleNamespace(id=user_id, is_bot=False),
+            content=content,
+            attachments=attachments,
+            user_mentions_ids=[BOT_USER_ID],
+            created_at=datetime.now(timezone.utc),
+            respond=_responder(sample, self.discord_latency),
+        )
+        return SimpleNamespace(
+            message=message,
+            is_human=True,
+            channel_id=channel_id,
+            guild_id=guild_id,
+            author_id=user_id,
+        )
+
+    def context(self, kind: str, sample: Sample, image_index: Any) -> Any:
+        user_id = random.randrange(self.users) + 1
+        guild_id = random.randrange(self.guilds) + 1
+        channel_id = guild_id * 100 + random.randrange(3)
+        if kind == "weather_command":
+            options = SimpleNamespace(location=", ".join(random.sample(CITIES, random.randint(1, 3))))
+        elif kind == "vision_command":
+            options = SimpleNamespace(prompt=self._question(), model=self.bot_module.DEFAULT_VISION_MODEL)
+        else:
+            options = SimpleNamespace(prompt=self._question(), model=self.bot_module.DEFAULT_MODEL)
+        if kind == "vision_command":
+            # The user posted an image earlier in this channel
+            message_id = next(self.ids)
+            image_index.add(channel_id, user_id, message_id, [self._image(message_id).url])
+        return SimpleNamespace(
+            options=options,
+            event=SimpleNamespace(message=SimpleNamespace(created_at=datetime.now(timezone.utc))),
+            channel_id=channel_id,
+            guild_id=guild_id,
+            author=SimpleNamespace(id=user_id),
+            respond=_responder(sample, self.discord_latency),
+        )
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _summarise(samples: List[Sample], wall_time: float) -> Dict[str, Any]:
+    done = [s for s in samples if s.finished is not None and s.error is None]
+    latencies = [(s.finished - s.started) * 1000 for s in done]
+    first_sends = [(s.first_send - s.started) * 1000 for s in done if s.first_send is not None]
+    by_kind: Dict[str, Dict[str, float]] = {}
+    for kind in MESSAGE_MIX:
+        kind_latencies = [(s.finished - s.started) * 1000 for s in done if s.kind == kind]
+        if kind_latencies:
+            by_kind[kind] = {
+                "count": len(kind_latencies),
+                "p50_ms": _percentile(kind_latencies, 50),
+                "p95_ms": _percentile(kind_latencies, 95),
+            }
+    return {
+        "events": len(samples),
+        "completed": len(done),
+        "errors": sum(1 for s in samples if s.error),
+        "busy": sum(1 for s in samples if s.busy),
+        "messages_per_second": len(done) / wall_time if wall_time else 0.0,
+        "latency_ms": {
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "mean": statistics.mean(latencies) if latencies else 0.0,
+        },
+        "first_send_ms": {
+            "p50": _percentile(first_sends, 50),
+            "p95": _percentile(first_sends, 95),
+            "p99": _percentile(first_sends, 99),
+        },
+        "discord_sends": sum(s.sends for s in samples),
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "by_kind": by_kind,
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    config = mock_servers.MockConfig(
+        ttft_ms=args.ttft_ms,
+        token_ms=args.token_ms,
+        completion_tokens=args.tokens,
+        rate_limit_ratio=args.rate_limit_ratio,
+    )
+    runner = await mock_servers.start(config)
+    base_url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+    # The bot reads its configuration at import time, so point it at the mocks first
+    cache_dir = tempfile.mkdtemp(prefix="bot-bench-")
+    os.environ.update({
+        "DISCORD_API_KEY": "bench",
+        "GROQ_API_KEY": "bench",
+        "GROQ_BASE_URL": base_url,
+        "GEO_API_KEY": "bench",
+        "WEATHER_API_KEY": "bench",
+        "GEOCODE_API_URL": f"{base_url}/search",
+        "WEATHER_API_URL": f"{base_url}/v4/weather/realtime",
+        "GEOCODE_CACHE_PATH": os.path.join(cache_dir, "geocode.sqlite3"),
+        "USAGE_LEDGER_PATH": os.path.join(cache_dir, "usage.sqlite3"),
+        "METRICS_PORT": "0",
+    })
+    if not args.respect_limits:
+        # Synthetic users and guilds would otherwise be shed by the per-user/guild buckets
+        for name, value in {
+            "USER_RATE_PER_MINUTE": "100000",
+            "USER_BURST": "100000",
+            "GUILD_RATE_PER_MINUTE": "100000",
+            "GUILD_BURST": "100000",
+        }.items():
+            os.environ.setdefault(name, value)
+
+    import bot as bot_module
+    from image_index import image_index
+
+    me = SimpleNamespace(id=BOT_USER_ID)
+    rest = FakeRest(args.discord_ms / 1000)
+    factory = EventFactory(bot_module, base_url, args.users, args.guilds, args.repeat_ratio, args.discord_ms / 1000)
+    samples: List[Sample] = []
+    tasks: List[asyncio.Task] = []
+
+    async def handle(kind: str) -> None:
+        sample = Sample(kind, time.perf_counter())
+        samples.append(sample)
+        try:
+            if kind.startswith("mention"):
+                await bot_module.on_message_create(factory.event(kind, sample))
+            else:
+                command = {
+                    "groq_command": bot_module.groq_command,
+                    "weather_command": bot_module.weather_command,
+                    "vision_command": bot_module.vision_command,
+                }[kind]
+                await command.callback(factory.context(kind, sample, image_index))
+        except Exception as e:
+            sample.error = f"{type(e).__name__}: {e}"
+        sample.finished = time.perf_counter()
+
+    kinds = list(MESSAGE_MIX)
+    weights = list(MESSAGE_MIX.values())
+    interval = 1.0 / args.rate
+
+    with mock.patch.object(type(bot_module.bot), "rest", new_callable=mock.PropertyMock, return_value=rest), \
+            mock.patch.object(type(bot_module.bot), "get_me", return_value=me, create=True):
+        await bot_module.http_pool.start()
+        started = time.perf_counter()
+        next_at = started
+        while time.perf_counter() - started < args.duration:
+            kind = random.choices(kinds, weights)[0]
+            tasks.append(asyncio.create_task(handle(kind)))
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        await asyncio.gather(*tasks)
+        wall_time = time.perf_counter() - started
+        await bot_module.http_pool.close()
+        bot_module.image_cache.shutdown()
+
+    results = _summarise(samples, wall_time)
+    results["target_rate"] = args.rate
+    results["errors_sample"] = [s.error for s in samples if s.error][:5]
+    results["upstream"] = runner.app["stats"]
+    await runner.cleanup()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=20.0, help="events per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--repeat-ratio", type=float, default=0.1, help="share of repeated FAQ-style prompts")
+    parser.add_argument("--ttft-ms", type=float, default=150.0)
+    parser.add_argument("--token-ms", type=float, default=10.0)
+    parser.add_argument("--tokens", type=int, default=60)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="share of completions answered with 429")
+    parser.add_argument("--discord-ms", type=float, default=30.0, help="latency of fake Discord calls")
+    parser.add_argument("--respect-limits", action="store_true", help="keep the bot's per-user/guild rate limits")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--max-p95-ms", type=float, help="exit non-zero if p95 latency exceeds this")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.max_p95_ms is not None and results["latency_ms"]["p95"] > args.max_p95_ms:
+        print(f"p95 latency {results['latency_ms']['p95']:.0f}ms exceeds {args.max_p95_ms:.0f}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
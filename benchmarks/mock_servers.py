@@ -0,0 +1,224 @@
+"""
+Local stand-ins for the Groq, geocode.maps.co, tomorrow.io and Discord CDN APIs.
+
+One aiohttp app serves all of them so the bot can be benchmarked offline:
+
+    /openai/v1/chat/completions   Groq chat completions (streaming and not)
+    /openai/v1/models             Groq model list
+    /search                       geocode.maps.co search
+    /v4/weather/realtime          tomorrow.io realtime weather
+    /attachments/{...}            Discord CDN image attachments
+
+Latency and 429 injection are configurable. Run standalone with
+
+    python benchmarks/mock_servers.py --port 8089 --ttft-ms 150 --token-ms 10
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from aiohttp import web
+
+# A 1x1 PNG, enough for the image pipeline to fetch and encode
+PIXEL_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+
+_WORDS = (
+    "the quick answer is that groq serves tokens very fast so this reply streams "
+    "into discord while the model is still generating the rest of the text"
+).split()
+
+
+@dataclass
+class MockConfig:
+    ttft_ms: float = 150.0  # Time to first token for completions
+    token_ms: float = 10.0  # Delay between streamed tokens
+    completion_tokens: int = 60
+    rate_limit_ratio: float = 0.0  # Fraction of completions answered with 429
+    geocode_ms: float = 80.0
+    weather_ms: float = 120.0
+    cdn_ms: float = 40.0
+
+
+def _ratelimit_headers(remaining: int = 1000) -> dict:
+    return {
+        "x-ratelimit-limit-requests": "14400",
+        "x-ratelimit-remaining-requests": str(remaining),
+        "x-ratelimit-reset-requests": "6s",
+        "x-ratelimit-limit-tokens": "18000",
+        "x-ratelimit-remaining-tokens": "17000",
+        "x-ratelimit-reset-tokens": "2s",
+    }
+
+
+def create_app(config: Optional[MockConfig] = None) -> web.Application:
+    """
+    Build the mock API application.
+    """
+    config = config or MockConfig()
+    app = web.Application()
+    app["config"] = config
+    app["stats"] = {"completions": 0, "rate_limited": 0, "geocode": 0, "weather": 0, "cdn": 0}
+
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        stats = request.app["stats"]
+        body = await request.json()
+        model = body.get("model", "mock-model")
+        stats["completions"] += 1
+
+        if random.random() < config.rate_limit_ratio:
+            stats["rate_limited"] += 1
+            headers = {**_ratelimit_headers(remaining=0), "retry-after": "1"}
+            error = {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+            return web.json_response(error, status=429, headers=headers)
+
+        await asyncio.sleep(config.ttft_ms / 1000)
+        completion_id = f"chatcmpl-{stats['completions']}"
+        created = int(time.time())
+        tokens = [random.choice(_WORDS) + " " for _ in range(config.completion_tokens)]
+        usage = {
+            "prompt_tokens": len(json.dumps(body.get("messages", []))) // 4,
+            "completion_tokens": len(tokens),
+            "total_tokens": len(json.dumps(body.get("messages", []))) // 4 + len(tokens),
+        }
+
+        if not body.get("stream"):
+            await asyncio.sleep(config.token_ms * len(tokens) / 1000)
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }, headers=_ratelimit_headers())
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", **_ratelimit_headers()})
+        await response.prepare(request)
+
+        async def send(delta: dict, finish_reason: Optional[str] = None, extra: Optional[dict] = None) -> None:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                **(extra or {}),
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        await send({"role": "assistant", "content": ""})
+        for token in tokens:
+            await send({"content": token})
+            await asyncio.sleep(config.token_ms / 1000)
+        await send({}, "stop", {"x_groq": {"id": completion_id, "usage": usage}})
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def models(request: web.Request) -> web.Response:
+        listed = [
+            ("llama-3.1-8b-instant", "Meta", 131072),
+            ("llama-3.3-70b-versatile", "Meta", 131072),
+            ("meta-llama/llama-4-scout-17b-16e-instruct", "Meta", 131072),
+            ("meta-llama/llama-4-maverick-17b-128e-instruct", "Meta", 131072),
+            ("whisper-large-v3", "OpenAI", 448),
+        ]
+        return web.json_response({
+            "object": "list",
+            "data": [
+                {"id": model_id, "object": "model", "created": 1700000000, "owned_by": owner,
+                 "active": True, "context_window": context_window, "max_completion_tokens": 32768}
+                for model_id, owner, context_window in listed
+            ],
+        })
+
+    async def geocode(request: web.Request) -> web.Response:
+        request.app["stats"]["geocode"] += 1
+        await asyncio.sleep(config.geocode_ms / 1000)
+        query = request.query.get("q", "")
+        if "nowhere" in query.lower():
+            return web.json_response([])
+        # Stable pseudo-coordinates per place name
+        seed = sum(ord(c) for c in query.lower())
+        return web.json_response([{"lat": str(seed % 140 - 70), "lon": str(seed % 340 - 170)}])
+
+    async def weather(request: web.Request) -> web.Response:
+        request.app["stats"]["weather"] += 1
+        await asyncio.sleep(config.weather_ms / 1000)
+        return web.json_response({
+            "data": {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "values": {
+                    "temperatureApparent": random.uniform(-5, 35),
+                    "weatherCode": random.choice([1000, 1100, 1101, 4001, 8000]),
+                    "humidity": random.randint(20, 95),
+                    "windSpeed": round(random.uniform(0, 12), 1),
+                },
+            },
+        })
+
+    async def attachment(request: web.Request) -> web.Response:
+        request.app["stats"]["cdn"] += 1
+        await asyncio.sleep(config.cdn_ms / 1000)
+        return web.Response(body=PIXEL_PNG, content_type="image/png")
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(request.app["stats"])
+
+    app.router.add_post("/openai/v1/chat/completions", chat_completions)
+    app.router.add_get("/openai/v1/models", models)
+    app.router.add_get("/search", geocode)
+    app.router.add_get("/v4/weather/realtime", weather)
+    app.router.add_get("/attachments/{path:.*}", attachment)
+    app.router.add_get("/_stats", stats)
+    return app
+
+
+async def start(config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+    """
+    Start the mock servers. The bound port is available as runner.addresses[0][1].
+    """
+    runner = web.AppRunner(create_app(config), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--ttft-ms", type=float, default=150.0)
+    parser.add_argument("--token-ms", type=float, default=10.0)
+    parser.add_argument("--tokens", type=int, default=60)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        ttft_ms=args.ttft_ms,
+        token_ms=args.token_ms,
+        completion_tokens=args.tokens,
+        rate_limit_ratio=args.rate_limit_ratio,
+    )
+    runner = await start(config, args.host, args.port)
+    print(f"Mock APIs listening on http://{args.host}:{args.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
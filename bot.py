@@ -1,28 +1,49 @@
-import hikari
-import lightbulb
-import aiohttp
-import base64
-import re
-from typing import Optional, List, Union, Dict, Any
+import time
+
+# Startup is timed from here to gateway READY
+_STARTED = time.perf_counter()
+
+import asyncio
+import hashlib
+import json
 import os
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
 import hikari
 import lightbulb
-import aiohttp
-import base64
-import re
-from typing import Optional, List, Union, Dict, Any
-import os
-import asyncio  
 from dotenv import load_dotenv
 
-from groq import Groq
-import weather_agent
+load_dotenv()
 
-from dotenv import load_dotenv
+# Local modules read their configuration from the environment at import time
+import http_pool
+import image_cache
+import metrics
+from batching import batcher
+from conversation import conversations, warm_up_tokenizer
+from deadline import REQUEST_DEADLINE, detached, hedged, request_deadline, until_deadline
+from geo_cache import geocode_cache
+from image_index import image_index, image_urls as attachment_image_urls
+from intents import GREETING, IGNORE, VISION, WEATHER, intents
+from job_queue import InProcessQueue, Job, create_queue
+from lazy import LazyModule, warm_up
+from model_catalog import model_catalog
+from prefetch import prefetcher
+from response_cache import response_cache
+from router import router
+from scheduler import BUSY_MESSAGE, Priority, SchedulerBusy, scheduler
+from streaming import StreamingReply, rest_sender, send_text
+from usage_ledger import attribute, token_counts, usage_ledger
+from weather_cache import weather_cache
 
-import weather_agent
+if TYPE_CHECKING:
+    from groq import AsyncGroq
 
-load_dotenv()
+# The weather agent pulls in pydantic-ai and logfire; it's loaded by the
+# background warm-up after the gateway is ready, or on first use
+weather_agent = LazyModule("weather_agent")
 
 # Initialize bot with lightbulb
 bot = lightbulb.BotApp(
@@ -35,81 +56,533 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
 DEFAULT_MODEL = "llama3-70b-8192"  # Updated to newer model
 DEFAULT_VISION_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"  # Using Llama 3.1 for vision
+IMAGE_HISTORY_SCAN_LIMIT = int(os.getenv("IMAGE_HISTORY_SCAN_LIMIT", "100"))  # Messages scanned for !vision on a cold start
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "llama-3.1-8b-instant")  # Small model for conversation summaries
+
+# Deployment mode: "standalone" answers in this process; "gateway" only classifies
+# events and puts jobs on the job queue for workers (see worker.py)
+BOT_MODE = os.getenv("BOT_MODE", "standalone")
+# Worker tasks a gateway runs itself when the job queue is in-process
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+# Exit once the gateway is ready, for the startup benchmark
+EXIT_ON_READY = os.getenv("EXIT_ON_READY", "false").lower() in ("1", "true", "yes")
+# Gateway sharding across processes, e.g. SHARD_IDS=0,1 SHARD_COUNT=4
+SHARD_IDS = [int(shard) for shard in os.getenv("SHARD_IDS", "").split(",") if shard.strip()] or None
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
 
-async def fetch_image(url: str) -> Optional[bytes]:
+async def start_services(metrics_port: Optional[int] = None) -> None:
     """
-    Fetch an image from a URL.
+    Open the shared HTTP connection pools, serve metrics and warm caches.
+    """
+    await http_pool.start()
+    await metrics.start_server(port=metrics.METRICS_PORT if metrics_port is None else metrics_port)
+    loaded = await geocode_cache.warm()
+    print(f"Geocode cache warmed with {loaded} locations")
+    usage_ledger.start()
+
+async def warm_up_services() -> None:
+    """
+    Load and initialise heavy subsystems in the background, once the bot is
+    already answering: the Groq SDK, model catalog, weather agent, tokenizer
+    and image workers. Anything needed before this finishes loads on first use.
+    """
+    await warm_up(groq_client)
+    model_catalog.start(groq_client())
+    await warm_up(weather_agent.load, warm_up_tokenizer, image_cache.warm_up)
+
+async def stop_services() -> None:
+    """
+    Close the shared HTTP connection pools and image workers.
+    """
+    await model_catalog.stop()
+    await http_pool.close()
+    await metrics.stop_server()
+    metrics.profiler.stop()
+    image_cache.shutdown()
+    await usage_ledger.stop()
+    print(f"Usage ledger stats: {usage_ledger.stats()}")
+    print(f"Geocode cache stats: {geocode_cache.stats()}")
+    print(f"Weather cache stats: {weather_cache.stats()}")
+    print(f"Response cache stats: {response_cache.stats()}")
+    print(f"Model catalog stats: {model_catalog.stats()}")
+    print(f"Image prefetch stats: {prefetcher.stats()}")
+
+@bot.listen(hikari.StartingEvent)
+async def on_starting(event: hikari.StartingEvent) -> None:
+    """
+    Start shared services before the gateway connects, plus in-process workers in gateway mode.
+    """
+    global _worker_task
+    await start_services()
+    if isinstance(jobs, InProcessQueue):
+        from worker import run_workers
+        _worker_task = asyncio.create_task(
+            run_workers(jobs, lambda job: handle_job(job, bot.rest), range(jobs.partitions), JOB_WORKERS)
+        )
+
+@bot.listen(hikari.StartedEvent)
+async def on_started(event: hikari.StartedEvent) -> None:
     """
+    Record how long the bot took to become ready, then warm up in the background.
+    """
+    global _warm_up_task
+    elapsed = time.perf_counter() - _STARTED
+    metrics.startup_seconds.observe(elapsed)
+    print(f"Gateway ready {elapsed:.2f}s after startup")
+    if EXIT_ON_READY:
+        await bot.close()
+        return
+    _warm_up_task = asyncio.create_task(warm_up_services())
+
+@bot.listen(hikari.StoppingEvent)
+async def on_stopping(event: hikari.StoppingEvent) -> None:
+    """
+    Stop in-process workers and close shared services.
+    """
+    if _worker_task is not None:
+        _worker_task.cancel()
+    if _warm_up_task is not None:
+        _warm_up_task.cancel()
+    if jobs is not None:
+        await jobs.close()
+    await stop_services()
+
+async def fetch_image(url: str, session: Optional[aiohttp.ClientSession] = None) -> Optional[bytes]:
+    """
+    Fetch an image from a URL using the shared connection pool, within the
+    request's deadline and hedged when the CDN is unusually slow.
+    """
+    session = session or http_pool.get_session()
+
+    async def get() -> Optional[bytes]:
+        async with session.get(url) as response:
+            if response.status == 200:
+                return await response.read()
+            else:
+                print(f"Error fetching image: {response.status}")
+                return None
+
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    return await response.read()
-                else:
-                    print(f"Error fetching image: {response.status}")
-                    return None
+        with metrics.image_fetch_latency.time():
+            return await hedged("image", get)
     except Exception as e:
         print(f"Exception when fetching image: {e}")
         return None
 
-from groq import Groq
+# Jobs go through the queue only when gateway and workers are split
+jobs = create_queue() if BOT_MODE == "gateway" else None
+_worker_task: Optional[asyncio.Task] = None
+# Prefetched images are only useful to the process that answers, i.e. not a gateway feeding remote workers
+PREFETCH_IMAGES = prefetcher.enabled and (jobs is None or isinstance(jobs, InProcessQueue))
+_warm_up_task: Optional[asyncio.Task] = None
+
+# Async Groq SDK client (no thread pool needed), created on first use
+_client: Optional["AsyncGroq"] = None
 
-# Initialize Groq SDK client
-client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+def groq_client() -> "AsyncGroq":
+    """
+    The shared Groq client. The SDK is imported on first use to keep it off the startup path.
+    """
+    global _client
+    if _client is None:
+        from groq import AsyncGroq
+        _client = AsyncGroq(api_key=os.environ.get("GROQ_API_KEY"))
+    return _client
+
+# Sampling parameters used for every completion
+GROQ_SAMPLING: Dict[str, Any] = {
+    "temperature": 0.7,
+    "max_completion_tokens": 1024,
+    "top_p": 1,
+}
+
+async def build_messages(
+    prompt: str, image_urls: List[str] = None
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Build the chat messages for a prompt, embedding any images as base64 data URIs.
+    Returns the messages and the content hashes of the embedded images.
+    """
+    # Prepare message content
+    content_blocks: List[Dict[str, Any]] = []
+    image_hashes: List[str] = []
+
+    # Add text prompt
+    content_blocks.append({
+        "type": "text",
+        "text": prompt
+    })
+
+    # Add images if any (only applies to vision models), downscaled and cached
+    if image_urls:
+        images = await asyncio.gather(*(prefetcher.get_image(url, fetch_image) for url in image_urls))
+        for image in images:
+            if image:
+                image_hashes.append(image.content_hash)
+                content_blocks.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image.data_uri
+                    }
+                })
+
+    # Prepare the message
+    return [{
+        "role": "user",
+        "content": content_blocks if image_urls else prompt
+    }], image_hashes
 
 async def query_groq(
     prompt: str, 
-    model: str = DEFAULT_MODEL,
+    model: Optional[str] = DEFAULT_MODEL,
     image_urls: List[str] = None
 ) -> Optional[str]:
     """
-    Use Groq Python SDK to query a model with optional image support.
+    Use Groq Python SDK to query a model with optional image support,
+    failing over to similar models. With no model, the router picks one.
     """
     try:
-        # Prepare message content
-        content_blocks: List[Dict[str, Any]] = []
-
-        # Add text prompt
-        content_blocks.append({
-            "type": "text",
-            "text": prompt
-        })
-
-        # Add images if any (only applies to vision models)
-        if image_urls:
-            for url in image_urls:
-                image_data = await fetch_image(url)
-                if image_data:
-                    base64_image = base64.b64encode(image_data).decode("utf-8")
-                    content_blocks.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
-                        }
-                    })
-
-        # Prepare the message
-        messages = [{
-            "role": "user",
-            "content": content_blocks if image_urls else prompt
-        }]
-
-        # Query Groq SDK
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
+        messages, _ = await build_messages(prompt, image_urls)
+        _, models = router.route(prompt, bool(image_urls), model)
+        return await complete_routed(messages, models)
+    except Exception as e:
+        print(f"Error querying Groq SDK: {e}")
+        return None
+
+async def complete_routed(messages: List[Dict[str, Any]], models: List[str]) -> Optional[str]:
+    """
+    Get a whole completion from the first of models that answers.
+    """
+    async def attempt(model: str) -> Optional[str]:
+        try:
+            return await complete_groq(messages, model)
+        except Exception as e:
+            record_rate_limit_error(e, model)
+            raise
+
+    text, _ = await router.run(models, attempt, kind="complete")
+    return text
+
+async def complete_groq(
+    messages: List[Dict[str, Any]],
+    model: str = DEFAULT_MODEL
+) -> Optional[str]:
+    """
+    Get a whole (non-streamed) completion from Groq.
+    """
+    # Query Groq SDK, keeping the raw response for its rate limit headers
+    started = time.perf_counter()
+    with metrics.groq_latency.time(model=model):
+        raw = await groq_client().chat.completions.with_raw_response.create(
             model=model,
             messages=messages,
-            temperature=0.7,
-            max_completion_tokens=1024,
-            top_p=1,
-            stream=False
+            stream=False,
+            **GROQ_SAMPLING
         )
+        scheduler.update_from_headers(raw.headers)
+        response = await raw.parse()
+
+    metrics.groq_requests.inc(model=model, status="ok")
+    usage_ledger.record(model, "complete", *token_counts(response.usage), time.perf_counter() - started)
+    return response.choices[0].message.content
+
+async def stream_groq(
+    messages: List[Dict[str, Any]],
+    model: str = DEFAULT_MODEL
+) -> AsyncIterator[str]:
+    """
+    Stream response tokens from Groq as they are generated.
+    Usage is recorded once the stream completes.
+    """
+    started = time.perf_counter()
+    raw = await groq_client().chat.completions.with_raw_response.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        **GROQ_SAMPLING
+    )
+    scheduler.update_from_headers(raw.headers)
+    stream = await raw.parse()
 
-        return response.choices[0].message.content
+    usage = None
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+        # Groq reports usage on the final chunk
+        usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or getattr(chunk, "usage", None) or usage
+    usage_ledger.record(model, "stream", *token_counts(usage), time.perf_counter() - started)
+
+async def open_stream(
+    messages: List[Dict[str, Any]],
+    model: str = DEFAULT_MODEL
+) -> Tuple[str, AsyncIterator[str]]:
+    """
+    Start streaming from Groq and wait for the first token, so the router can
+    fail over or hedge on time to first token. Returns it with the rest of the stream.
+    """
+    stream = stream_groq(messages, model)
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        first = ""
+    except BaseException:
+        await stream.aclose()
+        raise
+    return first, stream
+
+def _close_stream(opened: Tuple[str, AsyncIterator[str]]) -> None:
+    asyncio.ensure_future(opened[1].aclose())
+
+async def respond_with_groq(
+    respond: Callable[[str], Awaitable[Any]],
+    prompt: str,
+    model: Optional[str] = None,
+    image_urls: List[str] = None,
+    priority: Priority = Priority.MENTION,
+    user_id: Optional[int] = None,
+    guild_id: Optional[int] = None,
+    conversation_id: Optional[int] = None,
+    channel_id: Optional[int] = None
+) -> Optional[str]:
+    """
+    Answer a prompt from the response cache, or by streaming from Groq into
+    progressively edited messages. Errors end the stream early; whatever was
+    produced so far is kept. With a conversation_id (the channel or thread),
+    recent turns are sent along and the exchange is remembered. In channels
+    with micro-batching enabled the request joins a batch instead of streaming.
+    Without a model the router picks one from the prompt; either way a
+    rate-limited, failing or slow model is failed over to a similar one.
+
+    Raises:
+        SchedulerBusy: If the request was shed by the scheduler.
+    """
+    try:
+        messages, image_hashes = await build_messages(prompt, image_urls)
     except Exception as e:
-        print(f"Error querying Groq SDK: {e}")
+        print(f"Error preparing Groq request: {e}")
         return None
 
+    # Routed requests are cached per tier, since the model serving a tier shifts with latency
+    streaming = not batcher.enabled_for(channel_id)
+    tier, models = router.route(prompt, bool(image_urls), model, "stream" if streaming else "complete")
+    cache_model = model or f"auto:{tier}"
+    model = models[0]
+
+    # Repeated questions are answered without touching Groq, unless earlier turns change their meaning
+    has_history = conversation_id is not None and not conversations.is_empty(conversation_id)
+    cache_key = None
+    if not has_history and response_cache.enabled_for(guild_id, GROQ_SAMPLING["temperature"]):
+        cache_key = response_cache.key(cache_model, prompt, image_hashes, GROQ_SAMPLING)
+        started = time.perf_counter()
+        cached = await response_cache.lookup(cache_key, cache_model, prompt, bool(image_hashes))
+        if cached:
+            usage_ledger.record(cache_model, "cache", latency=time.perf_counter() - started, cache="hit")
+            await send_text(respond, cached, channel_id)
+            if conversation_id is not None:
+                conversations.append(conversation_id, prompt, cached)
+            return cached
+
+    # Include as much recent history as fits the model's prompt budget
+    if has_history:
+        messages = conversations.build(
+            conversation_id, model, GROQ_SAMPLING["max_completion_tokens"], messages
+        )
+
+    # Calls made from here on are cache misses (or uncacheable) in the usage ledger
+    with attribute(cache="miss" if cache_key else "off"):
+        if not streaming:
+            # Busy channels trade a few ms of batching window for throughput; identical requests merge
+            async def job() -> Optional[str]:
+                async with scheduler.slot(priority, user_id, guild_id):
+                    return await complete_routed(messages, models)
+
+            batch_key = hashlib.sha256(json.dumps([models, messages], sort_keys=True).encode("utf-8")).hexdigest()
+            try:
+                text = await batcher.submit(channel_id, batch_key, job)
+            except SchedulerBusy:
+                raise
+            except Exception as e:
+                print(f"Error querying Groq SDK: {e}")
+                return None
+            if text:
+                await send_text(respond, text, channel_id)
+        else:
+            async def attempt(candidate: str) -> Tuple[str, AsyncIterator[str]]:
+                try:
+                    return await open_stream(messages, candidate)
+                except Exception as e:
+                    record_rate_limit_error(e, candidate)
+                    raise
+
+            reply = StreamingReply(respond, channel_id=channel_id)
+            stream: Optional[AsyncIterator[str]] = None
+            try:
+                async with scheduler.slot(priority, user_id, guild_id):
+                    started = time.perf_counter()
+                    # Failover and hedging happen before the first token; after that the stream is committed
+                    (first, stream), model = await router.run(models, attempt, kind="stream", discard=_close_stream)
+                    metrics.groq_first_token.observe(time.perf_counter() - started, model=model)
+                    await reply.feed(first)
+                    # Past the deadline the user has stopped waiting; keep what was streamed
+                    async for token in until_deadline(stream):
+                        await reply.feed(token)
+                    metrics.groq_latency.observe(time.perf_counter() - started, model=model)
+            except SchedulerBusy:
+                raise
+            except Exception as e:
+                print(f"Error streaming from Groq SDK: {e}")
+                if stream is not None:
+                    # Closing the stream stops Groq generating tokens nobody will see
+                    asyncio.ensure_future(stream.aclose())
+                if reply.text:
+                    # Failed mid-stream; errors before the first token were counted per attempt
+                    record_rate_limit_error(e, model)
+                await reply.finish(interrupted=bool(reply.text))
+                # A partial answer is shown but never remembered or cached
+                return reply.text or None
+
+            metrics.groq_requests.inc(model=model, status="ok")
+            await reply.finish()
+            text = reply.text
+
+    if text and conversation_id is not None:
+        conversations.append(conversation_id, prompt, text)
+    if cache_key and text:
+        await response_cache.store(cache_key, cache_model, prompt, bool(image_hashes), text)
+    return text or None
+
+async def summarize_conversation(summary: str, turns: List[Dict[str, str]]) -> Optional[str]:
+    """
+    Fold older conversation turns into a short rolling summary using a small, fast model.
+    """
+    transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    prompt = (
+        "Summarise this conversation in at most five sentences, keeping names, facts and open questions.\n"
+        f"Earlier summary: {summary or 'none'}\n\n{transcript}"
+    )
+    # Runs in the background after the reply, so the request's deadline doesn't apply
+    with detached(), attribute(command="summary"):
+        return await query_groq(prompt, SUMMARY_MODEL)
+
+conversations.summarizer = summarize_conversation
+
+# Cache effectiveness, read when /metrics is scraped
+metrics.CallbackGauge("bot_cache_hits", "Cache hits by cache", "cache", lambda: {
+    "geocode": geocode_cache.hits,
+    "weather": weather_cache.hits + weather_cache.stale_hits,
+    "response": response_cache.stats()["hits"],
+    "image": image_cache.stats()["urls"]["hits"],
+})
+metrics.CallbackGauge("bot_cache_misses", "Cache misses by cache", "cache", lambda: {
+    "geocode": geocode_cache.misses,
+    "weather": weather_cache.misses,
+    "response": response_cache.stats()["misses"],
+    "image": image_cache.stats()["urls"]["misses"],
+})
+
+def record_rate_limit_error(error: Exception, model: str) -> None:
+    """
+    Count a failed Groq request, and let the scheduler back off when Groq answers with 429.
+    """
+    response = getattr(error, "response", None)
+    if response is not None and getattr(response, "status_code", None) == 429:
+        metrics.groq_requests.inc(model=model, status="rate_limited")
+        metrics.groq_rate_limited.inc()
+        scheduler.update_from_headers(response.headers)
+    else:
+        metrics.groq_requests.inc(model=model, status="error")
+
+async def trigger_typing(channel_id: int) -> None:
+    """
+    Show the typing indicator, recording how long Discord took.
+    """
+    with metrics.typing_latency.time():
+        await bot.rest.trigger_typing(channel_id)
+
+def sent_at(message: hikari.Message) -> float:
+    """
+    When the user sent a message (from its snowflake); their request's deadline counts from here.
+    """
+    return message.created_at.timestamp()
+
+def record_event(event: hikari.GuildMessageCreateEvent, kind: str) -> None:
+    """
+    Count a gateway message event and how long it took to reach us.
+    """
+    metrics.gateway_events.inc(kind=kind)
+    lag = (datetime.now(timezone.utc) - event.message.created_at).total_seconds()
+    metrics.gateway_lag.observe(max(lag, 0.0))
+
+async def run_job(job: Job, respond: Callable[[str], Awaitable[Any]]) -> None:
+    """
+    Do the slow part of a request: a Groq completion or a weather lookup,
+    replying through respond. Per-channel state changes are jobs too, so in
+    gateway mode they reach the worker that owns the channel.
+    Everything the job calls shares one deadline, counted from the user's message.
+    """
+    # Clamped because Discord's clock and ours can disagree by a little
+    left = REQUEST_DEADLINE - max(job.age, 0.0)
+    if job.is_request and left <= 0:
+        # Queued for longer than anyone waits; don't spend Groq calls on it
+        await respond(BUSY_MESSAGE)
+        return
+    with request_deadline(left), attribute(
+        guild_id=job.guild_id, user_id=job.user_id, command=job.payload.get("command", job.kind)
+    ):
+        await _run_job(job, respond)
+
+async def _run_job(job: Job, respond: Callable[[str], Awaitable[Any]]) -> None:
+    payload = job.payload
+    if job.kind == "chat":
+        try:
+            response = await respond_with_groq(
+                respond, payload["prompt"], payload["model"], payload.get("image_urls") or [],
+                Priority(job.priority), job.user_id, job.guild_id,
+                conversation_id=job.channel_id, channel_id=job.channel_id
+            )
+        except SchedulerBusy:
+            await respond(BUSY_MESSAGE)
+            return
+        if not response:
+            await respond(payload["error"])
+    elif job.kind == "weather":
+        try:
+            agent = await weather_agent.aload()
+            weather_result = await agent.get_weather_for_locations(payload["locations"])
+        except Exception as e:
+            print(f"Error getting weather: {e}")
+            await respond(payload["error"])
+            return
+        if weather_result.get('success', False):
+            await respond(weather_result['response'])
+        elif payload.get("show_error") and 'error' in weather_result:
+            await respond(f"{payload['error']} Error: {weather_result['error']}")
+        else:
+            await respond(payload["error"])
+    elif job.kind == "forget":
+        conversations.clear(job.channel_id)
+    elif job.kind == "batching":
+        batcher.set_channel_enabled(job.channel_id, payload["enabled"])
+    elif job.kind == "responsecache":
+        response_cache.set_guild_enabled(job.guild_id, payload["enabled"])
+    else:
+        print(f"Unknown job kind: {job.kind}")
+
+async def dispatch_job(job: Job, respond: Callable[[str], Awaitable[Any]]) -> None:
+    """
+    Run a job here, or hand it to the workers when running as a gateway.
+    """
+    if jobs is not None:
+        await jobs.put(job)
+    else:
+        await run_job(job, respond)
+
+async def handle_job(job: Job, rest: Any) -> None:
+    """
+    Run a job taken off the queue, replying in its channel over REST.
+    """
+    await run_job(job, rest_sender(rest, job.channel_id))
+
 
 @bot.listen(hikari.GuildMessageCreateEvent)
 async def on_message_create(event: hikari.GuildMessageCreateEvent) -> None:
@@ -120,146 +593,160 @@ async def on_message_create(event: hikari.GuildMessageCreateEvent) -> None:
     if not event.is_human:
         return
     
-    # Skip messages that aren't in guilds
-    if not event.message or not event.message.content:
+    # Remember image attachments so !vision can find them without REST calls;
+    # this is the only pass over the attachments
+    message = event.message
+    image_urls = image_index.record(message) if message.attachments else ()
+    if image_urls and PREFETCH_IMAGES:
+        # Opted-in channels start downloading before we know if the bot will be asked
+        prefetcher.prefetch(event.channel_id, image_urls, fetch_image)
+    
+    if intents.bot_id is None:
+        me = bot.get_me()
+        if me is None:
+            return
+        intents.set_bot_id(me.id)
+    
+    # Messages that don't mention the bot are rejected here, before any text is looked at
+    intent = intents.classify(message, image_urls)
+    if intent.kind == IGNORE:
+        return
+    
+    record_event(event, "mention")
+    if intent.kind == GREETING:
+        await message.respond("Hello! How can I help you today? Ask me any question.")
         return
     
-    content = event.message.content
-    me = bot.get_me()
+    # Show typing indicator while processing
+    await trigger_typing(event.channel_id)
     
-    # Check if the bot is mentioned
-    if me and me.id in event.message.user_mentions_ids:
-        # Get the question by removing the mention
-        question = content.replace(f"<@{me.id}>", "").strip()
-        
-        if not question:
-            await event.message.respond("Hello! How can I help you today? Ask me any question.")
-            return
-        
-        # Show typing indicator while processing
-        await bot.rest.trigger_typing(event.channel_id)
-        
-        # Check for weather-related questions
-        weather_pattern = re.compile(r'weather\s+in\s+([a-zA-Z\s,]+)', re.IGNORECASE)
-        weather_match = weather_pattern.search(question)
-        
-        if weather_match:
-            # Extract location(s)
-            locations_text = weather_match.group(1)
-            locations = [loc.strip() for loc in locations_text.split(",") if loc.strip()]
-            
-            if locations:
-                try:
-                    # Show typing indicator again to indicate processing
-                    await bot.rest.trigger_typing(event.channel_id)
-                    
-                    # Get weather using PydanticAI agent with Groq
-                    weather_result = await weather_agent.get_weather_for_locations(locations)
-                    
-                    if weather_result.get('success', False):
-                        # Send response from the weather agent
-                        await event.message.respond(weather_result['response'])
-                    else:
-                        # Send error message
-                        await event.message.respond("I'm sorry, I couldn't get the weather information at the moment. Please try again later.")
-                    return
-                except Exception as e:
-                    print(f"Error getting weather: {e}")
-                    await event.message.respond("I'm sorry, I couldn't get the weather information at the moment. Please try again later.")
-                    return
-        
-        # Check for image attachments
-        image_urls = []
-        if event.message.attachments:
-            for attachment in event.message.attachments:
-                if attachment.media_type and attachment.media_type.startswith('image/'):
-                    image_urls.append(attachment.url)
-        
-        # Determine which model to use based on whether images are present
-        model = DEFAULT_VISION_MODEL if image_urls else DEFAULT_MODEL
-        
-        # Get response from Groq
-        response = await query_groq(question, model, image_urls)
-        
-        if response:
-            # Send response in chunks if needed
-            if len(response) > 2000:
-                chunks = [response[i:i+2000] for i in range(0, len(response), 2000)]
-                for chunk in chunks:
-                    await event.message.respond(chunk)
-            else:
-                await event.message.respond(response)
-        else:
-            await event.message.respond("I'm sorry, I couldn't process your question right now. Please try again later.")
+    if intent.kind == WEATHER:
+        # Get weather using PydanticAI agent with Groq
+        metrics.commands.inc(command="weather_mention")
+        await dispatch_job(Job(
+            "weather", event.channel_id, event.guild_id, event.author_id,
+            {
+                "locations": list(intent.locations), "command": "weather_mention",
+                "error": "I'm sorry, I couldn't get the weather information at the moment. Please try again later.",
+            },
+            Priority.MENTION, created_at=sent_at(message),
+        ), message.respond)
+        return
+    
+    command = "vision_mention" if intent.kind == VISION else "mention"
+    metrics.commands.inc(command=command)
+    
+    # Stream the response from Groq into progressively edited messages
+    await dispatch_job(Job(
+        "chat", event.channel_id, event.guild_id, event.author_id,
+        {
+            "prompt": intent.question, "model": None, "image_urls": list(intent.image_urls), "command": command,
+            "error": "I'm sorry, I couldn't process your question right now. Please try again later.",
+        },
+        Priority.MENTION, created_at=sent_at(message),
+    ), message.respond)
 
 # Command to handle specific model requests
 @bot.command
-@lightbulb.option("model", "The model to use", required=False, default=DEFAULT_MODEL)
+@lightbulb.option("model", "The model to use (picked automatically if not given)", required=False, default=None)
 @lightbulb.option("prompt", "Your question or prompt", required=True)
 @lightbulb.command("groq", "Ask a question using Groq API")
 @lightbulb.implements(lightbulb.PrefixCommand)
 async def groq_command(ctx: lightbulb.Context) -> None:
-    # Show typing indicator
-    await bot.rest.trigger_typing(ctx.channel_id)
+    metrics.commands.inc(command="groq")
     
-    # Get response
-    response = await query_groq(ctx.options.prompt, ctx.options.model)
+    # Reject unknown models locally instead of paying for a failed round-trip
+    if ctx.options.model:
+        error = model_catalog.validate(ctx.options.model)
+        if error:
+            await ctx.respond(error)
+            return
     
-    if response:
-        # Send in chunks if needed
-        if len(response) > 2000:
-            chunks = [response[i:i+2000] for i in range(0, len(response), 2000)]
-            for chunk in chunks:
-                await ctx.respond(chunk)
-        else:
-            await ctx.respond(response)
-    else:
-        await ctx.respond("Sorry, I couldn't get a response from Groq. Please try again later.")
+    # Show typing indicator
+    await trigger_typing(ctx.channel_id)
+    
+    # Stream the response into progressively edited messages
+    await dispatch_job(Job(
+        "chat", ctx.channel_id, ctx.guild_id, ctx.author.id,
+        {
+            "prompt": ctx.options.prompt, "model": ctx.options.model, "command": "groq",
+            "error": "Sorry, I couldn't get a response from Groq. Please try again later.",
+        },
+        Priority.COMMAND, created_at=sent_at(ctx.event.message),
+    ), ctx.respond)
+
+async def find_latest_image(channel_id: int, user_id: int) -> Optional[str]:
+    """
+    Find a user's most recent image in a channel.
+    Served from the gateway-fed image index; channel history is only
+    scanned while the index is still cold after startup.
+    """
+    url = image_index.latest(channel_id, user_id)
+    if url or not image_index.is_cold:
+        return url
+
+    try:
+        async for message in bot.rest.fetch_messages(channel_id).limit(IMAGE_HISTORY_SCAN_LIMIT):
+            if message.author.id == user_id and message.attachments:
+                urls = attachment_image_urls(message)
+                if urls:
+                    image_index.add(channel_id, user_id, message.id, urls[:1])
+                    return urls[0]
+    except hikari.HikariError as e:
+        print(f"Error scanning channel history for images: {e}")
+    return None
+
+@bot.listen(hikari.GuildMessageDeleteEvent)
+async def on_message_delete(event: hikari.GuildMessageDeleteEvent) -> None:
+    """
+    Drop deleted messages from the image index.
+    """
+    image_index.remove(event.message_id)
+
+@bot.listen(hikari.GuildBulkMessageDeleteEvent)
+async def on_bulk_message_delete(event: hikari.GuildBulkMessageDeleteEvent) -> None:
+    """
+    Drop bulk-deleted messages from the image index.
+    """
+    for message_id in event.message_ids:
+        image_index.remove(message_id)
 
 # Command to process images with specific model
 @bot.command
-@lightbulb.option("model", "The vision model to use", required=False, default=DEFAULT_VISION_MODEL)
+@lightbulb.option("model", "The vision model to use (picked automatically if not given)", required=False, default=None)
 @lightbulb.option("prompt", "Your question about the image", required=True)
 @lightbulb.command("vision", "Ask a question about the last image you uploaded")
 @lightbulb.implements(lightbulb.PrefixCommand)
 async def vision_command(ctx: lightbulb.Context) -> None:
-    # Show typing indicator
-    await bot.rest.trigger_typing(ctx.channel_id)
+    metrics.commands.inc(command="vision")
     
-    # Get the channel
-    channel = await bot.rest.fetch_channel(ctx.channel_id)
+    if ctx.options.model:
+        error = model_catalog.validate(ctx.options.model, vision=True)
+        if error:
+            await ctx.respond(error)
+            return
     
-    # Fetch recent messages to find the latest image
-    messages = await bot.rest.fetch_messages(channel.id, limit=10)
+    # Show typing indicator
+    await trigger_typing(ctx.channel_id)
     
-    # Find the most recent message with an image from the user
-    image_urls = []
-    for message in messages:
-        if message.author.id == ctx.author.id and message.attachments:
-            for attachment in message.attachments:
-                if attachment.media_type and attachment.media_type.startswith('image/'):
-                    image_urls.append(attachment.url)
-                    break
-            if image_urls:
-                break
+    # Find the user's most recent image in this channel
+    image_url = await find_latest_image(ctx.channel_id, ctx.author.id)
+    image_urls = [image_url] if image_url else []
     
     if not image_urls:
         await ctx.respond("I couldn't find any recent images you've uploaded. Please upload an image first.")
         return
     
-    # Get response
-    response = await query_groq(ctx.options.prompt, ctx.options.model, image_urls)
-    
-    if response:
-        # Send in chunks if needed
-        if len(response) > 2000:
-            chunks = [response[i:i+2000] for i in range(0, len(response), 2000)]
-            for chunk in chunks:
-                await ctx.respond(chunk)
-        else:
-            await ctx.respond(response)
-    else:
-        await ctx.respond("Sorry, I couldn't get a response from Groq. Please try again later.")
+    # Stream the response into progressively edited messages; the image is
+    # resolved here because the gateway-fed index lives in this process
+    await dispatch_job(Job(
+        "chat", ctx.channel_id, ctx.guild_id, ctx.author.id,
+        {
+            "prompt": ctx.options.prompt, "model": ctx.options.model, "image_urls": image_urls, "command": "vision",
+            "error": "Sorry, I couldn't get a response from Groq. Please try again later.",
+        },
+        Priority.COMMAND, created_at=sent_at(ctx.event.message),
+    ), ctx.respond)
 
 # Weather command using PydanticAI with Groq
 @bot.command
@@ -267,9 +754,10 @@ async def vision_command(ctx: lightbulb.Context) -> None:
 @lightbulb.command("weather", "Get the current weather for a location using PydanticAI with Groq")
 @lightbulb.implements(lightbulb.PrefixCommand)
 async def weather_command(ctx: lightbulb.Context) -> None:
+    metrics.commands.inc(command="weather")
     try:
         # Show typing indicator
-        await bot.rest.trigger_typing(ctx.channel_id)
+        await trigger_typing(ctx.channel_id)
         
         # Parse locations
         locations = [loc.strip() for loc in ctx.options.location.split(",") if loc.strip()]
@@ -278,47 +766,132 @@ async def weather_command(ctx: lightbulb.Context) -> None:
             await ctx.respond("Please provide a valid location.")
             return
         
-        # Get weather using PydanticAI agent with Groq
-        weather_result = await weather_agent.get_weather_for_locations(locations)
-        
-        if weather_result.get('success', False):
-            # Send response
-            await ctx.respond(weather_result['response'])
-        else:
-            # Send error message with any available details
-            error_msg = "Sorry, I couldn't get the weather information at the moment."
-            if 'error' in weather_result:
-                error_msg += f" Error: {weather_result['error']}"
-            await ctx.respond(error_msg)
+        # Get weather using PydanticAI agent with Groq, with any available error details
+        await dispatch_job(Job(
+            "weather", ctx.channel_id, ctx.guild_id, ctx.author.id,
+            {
+                "locations": locations, "command": "weather",
+                "error": "Sorry, I couldn't get the weather information at the moment.",
+                "show_error": True,
+            },
+            Priority.COMMAND, created_at=sent_at(ctx.event.message),
+        ), ctx.respond)
     except Exception as e:
         print(f"Error in weather command: {e}")
         await ctx.respond("Sorry, I couldn't get the weather information at the moment. Please try again later.")
 
-# Command to show available models
+# Command to forget the conversation in this channel
+@bot.command
+@lightbulb.command("forget", "Forget the conversation history in this channel")
+@lightbulb.implements(lightbulb.PrefixCommand)
+async def forget_command(ctx: lightbulb.Context) -> None:
+    await dispatch_job(Job("forget", ctx.channel_id, ctx.guild_id, ctx.author.id, {}), ctx.respond)
+    await ctx.respond("Okay, I've forgotten our conversation in this channel.")
+
+# Command to turn micro-batching on or off for a channel
+@bot.command
+@lightbulb.add_checks(lightbulb.guild_only, lightbulb.has_guild_permissions(hikari.Permissions.MANAGE_CHANNELS))
+@lightbulb.option("state", "on or off", choices=["on", "off"], required=True)
+@lightbulb.command("batching", "Batch requests in this channel for throughput (answers aren't streamed)")
+@lightbulb.implements(lightbulb.PrefixCommand)
+async def batching_command(ctx: lightbulb.Context) -> None:
+    enabled = ctx.options.state == "on"
+    await dispatch_job(Job("batching", ctx.channel_id, ctx.guild_id, ctx.author.id, {"enabled": enabled}), ctx.respond)
+    await ctx.respond(f"Request batching is now {'on' if enabled else 'off'} for this channel.")
+
+# Command to turn the response cache on or off for a server
+@bot.command
+@lightbulb.add_checks(lightbulb.guild_only, lightbulb.has_guild_permissions(hikari.Permissions.MANAGE_GUILD))
+@lightbulb.option("state", "on or off", choices=["on", "off"], required=True)
+@lightbulb.command("responsecache", "Turn cached answers on or off for this server")
+@lightbulb.implements(lightbulb.PrefixCommand)
+async def responsecache_command(ctx: lightbulb.Context) -> None:
+    enabled = ctx.options.state == "on"
+    # A server's channels are spread over all partitions, so every worker needs the setting
+    await dispatch_job(
+        Job("responsecache", ctx.channel_id, ctx.guild_id, ctx.author.id, {"enabled": enabled}, broadcast=True),
+        ctx.respond,
+    )
+    await ctx.respond(f"Cached answers are now {'on' if enabled else 'off'} for this server.")
+
+# Command to show this server's Groq usage from the usage ledger
+@bot.command
+@lightbulb.add_checks(lightbulb.guild_only, lightbulb.has_guild_permissions(hikari.Permissions.MANAGE_GUILD))
+@lightbulb.option("days", "How many days back to count", type=int, required=False, default=30)
+@lightbulb.command("usage", "Show this server's Groq token usage")
+@lightbulb.implements(lightbulb.PrefixCommand)
+async def usage_command(ctx: lightbulb.Context) -> None:
+    if not usage_ledger.path:
+        await ctx.respond("The usage ledger is turned off.")
+        return
+    days = max(1, ctx.options.days)
+    try:
+        totals = await usage_ledger.totals(ctx.guild_id, days)
+    except Exception as e:
+        print(f"Error reading usage ledger: {e}")
+        await ctx.respond("Sorry, I couldn't read the usage ledger right now.")
+        return
+    if not totals["calls"]:
+        await ctx.respond(f"No usage recorded for this server in the last {days} days.")
+        return
+    lines = [
+        f"**Usage for this server, last {days} days**",
+        f"{totals['calls']} calls, {totals['cache_hits']} answered from cache",
+        f"{totals['prompt_tokens']:,} prompt + {totals['completion_tokens']:,} completion tokens",
+        f"Average latency {totals['avg_latency']:.2f}s",
+        "",
+        "**By model**",
+    ]
+    lines += [
+        f"- {model}: {calls} calls, {prompt:,} + {completion:,} tokens, {latency:.2f}s avg"
+        for model, calls, prompt, completion, latency in totals["by_model"]
+    ]
+    lines += ["", "**By command**"]
+    lines += [f"- {command or 'other'}: {calls} calls, {tokens:,} tokens" for command, calls, tokens in totals["by_command"]]
+    await send_text(ctx.respond, "\n".join(lines), ctx.channel_id)
+
+# Owner-only command to sample where the event loop spends its time
+@bot.command
+@lightbulb.add_checks(lightbulb.owner_only)
+@lightbulb.option("action", "start, stop or status", choices=["start", "stop", "status"], required=True)
+@lightbulb.command("profile", "Toggle the sampling profiler (owner only)")
+@lightbulb.implements(lightbulb.PrefixCommand)
+async def profile_command(ctx: lightbulb.Context) -> None:
+    if ctx.options.action == "start":
+        # Sample the thread running the event loop, which is this one
+        metrics.profiler.start()
+        await ctx.respond("Sampling profiler started.")
+    elif ctx.options.action == "stop":
+        metrics.profiler.stop()
+        await ctx.respond(f"```\n{metrics.profiler.report()}\n```")
+    else:
+        state = "running" if metrics.profiler.running else "stopped"
+        await ctx.respond(f"Profiler is {state}.\n```\n{metrics.profiler.report()}\n```")
+
+# Command to show available models, served from the model catalog
 @bot.command
 @lightbulb.command("models", "Display available Groq models")
 @lightbulb.implements(lightbulb.PrefixCommand)
 async def models_command(ctx: lightbulb.Context) -> None:
-    models_info = """
+    if model_catalog.loaded:
+        models_list = "\n".join(model_catalog.describe())
+    else:
+        # Not fetched yet (or Groq unreachable since startup): show what requests are routed to
+        models_list = "\n".join(
+            [f"{tier.title()} Models:\n" + "\n".join(f"- {model}" for model in models) for tier, models in router.tiers.items()]
+        )
+    models_info = f"""
 Available Groq Models:
 
-Text Models:
-- llama-3.1-8b-versatile: Meta's Llama 3.1 8B model (fastest)
-- llama-3.1-70b-versatile: Meta's Llama 3.1 70B model (more capable, default for text)
-- llama-3.1-405b-versatile: Meta's Llama 3.1 405B model (most capable)
-- mixtral-8x7b-32768: Mixtral 8x7B model with 32k context
-- gemma-7b-it: Google's Gemma 7B model
-
-Vision Models:
-- llama-3.1-8b-vision: Llama 3.1 8B vision model (default for images)
+{models_list}
 
 Usage:
-- Just mention me with your question (with or without attached images)
+- Just mention me with your question (with or without attached images); I'll pick a model
 - Use !groq prompt model:<model> for text-only queries
 - Use !vision prompt model:<model> for image queries (uses your most recent image)
 - Use !weather location to get current weather information with PydanticAI
     """
-    await ctx.respond(models_info)
+    await send_text(ctx.respond, models_info, ctx.channel_id)
 
 # Help command
 @bot.command
@@ -339,18 +912,22 @@ Advanced Commands:
 - !vision prompt model:<optional_model> - Ask about your most recently posted image
 - !weather location - Get current weather for a specific location using PydanticAI with Groq
 - !models - See available AI models
+- !forget - Forget the conversation history in this channel
+- !batching on|off - Batch requests in a busy channel for throughput (Manage Channels)
+- !responsecache on|off - Turn cached answers on or off for this server (Manage Server)
+- !usage days:<optional_days> - Show this server's token usage (Manage Server)
 - !bothelp - Display this help message
 
 Examples:
 - @BotName What's the capital of France?
 - @BotName What's the weather in Bangkok?
 - @BotName [with image attached] What's in this image?
-- !groq "Explain quantum computing simply" model:llama-3.1-8b-versatile
-- !vision "What's shown in this picture?" model:llama-3.1-8b-vision
+- !groq "Explain quantum computing simply" model:llama-3.3-70b-versatile
+- !vision "What's shown in this picture?" model:meta-llama/llama-4-scout-17b-16e-instruct
 - !weather Tokyo, London, Paris
     """
     await ctx.respond(help_text)
 
 # Run the bot
 if __name__ == "__main__":
-    bot.run()
+    bot.run(shard_ids=SHARD_IDS, shard_count=SHARD_COUNT)
@@ -0,0 +1,203 @@
+"""
+Per-channel conversation memory for follow-up questions.
+Each channel (threads are channels too) keeps a small ring buffer of recent
+turns. When a request is built, the newest turns that fit the model's prompt
+budget are included; older turns can be folded into a rolling summary.
+Idle conversations are evicted LRU so memory stays bounded.
+"""
+
+import asyncio
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from cache_utils import LRUCache
+
+# tiktoken is slow to load, so the encoding is loaded on first use (or by warm_up_tokenizer);
+# if it can't be loaded (e.g. the encoding file can't be downloaded) token counts are estimated
+_encoding: Any = None
+_encoding_loaded = False
+
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "16"))
+CONVERSATION_MAX_CHANNELS = int(os.getenv("CONVERSATION_MAX_CHANNELS", "5000"))
+CONVERSATION_IDLE_TTL = float(os.getenv("CONVERSATION_IDLE_TTL", "3600"))
+# Upper bound on prompt tokens regardless of the model's context window
+CONVERSATION_MAX_PROMPT_TOKENS = int(os.getenv("CONVERSATION_MAX_PROMPT_TOKENS", "6000"))
+CONVERSATION_SUMMARIZE = os.getenv("CONVERSATION_SUMMARIZE", "false").lower() in ("1", "true", "yes")
+# Dropped turns are summarised once they add up to this many tokens
+CONVERSATION_SUMMARY_TRIGGER = int(os.getenv("CONVERSATION_SUMMARY_TRIGGER", "1500"))
+
+DEFAULT_CONTEXT_WINDOW = 8192
+# Known context windows; models not listed get DEFAULT_CONTEXT_WINDOW
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = {
+    "llama3-70b-8192": 8192,
+    "llama3-8b-8192": 8192,
+    "llama-3.1-8b-instant": 131072,
+    "llama-3.3-70b-versatile": 131072,
+    "meta-llama/llama-4-scout-17b-16e-instruct": 131072,
+    "meta-llama/llama-4-maverick-17b-128e-instruct": 131072,
+}
+
+# Per-message overhead of the chat format (role markers etc.)
+_MESSAGE_OVERHEAD = 4
+
+Summarizer = Callable[[str, List[Dict[str, str]]], Awaitable[Optional[str]]]
+
+
+def warm_up_tokenizer() -> None:
+    """
+    Load the tiktoken encoding, if tiktoken is installed.
+    """
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception:  # fall back to a character estimate
+        _encoding = None
+    _encoding_loaded = True
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count tokens with tiktoken when available, otherwise estimate ~4 characters per token.
+    """
+    if not _encoding_loaded:
+        warm_up_tokenizer()
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    content = message.get("content")
+    if isinstance(content, list):
+        # Only text blocks count here; images are priced separately by the API
+        text = " ".join(block.get("text", "") for block in content if block.get("type") == "text")
+    else:
+        text = content or ""
+    return count_tokens(text) + _MESSAGE_OVERHEAD
+
+
+def prompt_budget(model: str, completion_tokens: int) -> int:
+    """
+    Tokens available for the prompt after reserving room for the completion.
+    """
+    context_window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    return min(CONVERSATION_MAX_PROMPT_TOKENS, context_window - completion_tokens)
+
+
+@dataclass
+class Turn:
+    role: str
+    content: str
+    tokens: int
+
+
+@dataclass
+class Conversation:
+    turns: Deque[Turn] = field(default_factory=lambda: deque(maxlen=CONVERSATION_MAX_TURNS))
+    summary: str = ""
+    dropped: List[Turn] = field(default_factory=list)
+
+
+class ConversationStore:
+    """
+    Bounded store of recent turns per channel.
+    """
+
+    def __init__(
+        self,
+        max_channels: int = CONVERSATION_MAX_CHANNELS,
+        idle_ttl: float = CONVERSATION_IDLE_TTL,
+        summarizer: Optional[Summarizer] = None,
+    ) -> None:
+        self._conversations: LRUCache[Conversation] = LRUCache(maxsize=max_channels, ttl=idle_ttl)
+        self.summarizer = summarizer
+        self._summarizing: Set[asyncio.Task] = set()
+
+    def _get(self, key: int) -> Optional[Conversation]:
+        return self._conversations.get(key)
+
+    def is_empty(self, key: int) -> bool:
+        conversation = self._get(key)
+        return conversation is None or (not conversation.turns and not conversation.summary)
+
+    def build(self, key: int, model: str, completion_tokens: int, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Prefix the new request messages with as much recent history as fits the prompt budget.
+        """
+        conversation = self._get(key)
+        if conversation is None:
+            return messages
+
+        budget = prompt_budget(model, completion_tokens) - sum(message_tokens(m) for m in messages)
+        prefix: List[Dict[str, Any]] = []
+        if conversation.summary:
+            summary = {"role": "system", "content": f"Summary of the earlier conversation: {conversation.summary}"}
+            summary_tokens = message_tokens(summary)
+            if summary_tokens <= budget:
+                prefix.append(summary)
+                budget -= summary_tokens
+
+        # Walk back from the newest turn until the budget runs out
+        history: List[Dict[str, Any]] = []
+        for turn in reversed(conversation.turns):
+            cost = turn.tokens + _MESSAGE_OVERHEAD
+            if cost > budget:
+                break
+            history.append({"role": turn.role, "content": turn.content})
+            budget -= cost
+        history.reverse()
+        # A window must not start with a dangling assistant reply
+        if history and history[0]["role"] == "assistant":
+            history.pop(0)
+
+        return prefix + history + messages
+
+    def append(self, key: int, user_text: str, assistant_text: str) -> None:
+        """
+        Record a completed exchange.
+        """
+        conversation = self._get(key) or Conversation()
+        for role, content in (("user", user_text), ("assistant", assistant_text)):
+            if len(conversation.turns) == conversation.turns.maxlen:
+                conversation.dropped.append(conversation.turns[0])
+            conversation.turns.append(Turn(role, content, count_tokens(content)))
+        # Re-setting refreshes the idle TTL and LRU position
+        self._conversations.set(key, conversation)
+        self._maybe_summarize(conversation)
+
+    def clear(self, key: int) -> None:
+        self._conversations.pop(key)
+
+    def _maybe_summarize(self, conversation: Conversation) -> None:
+        if not CONVERSATION_SUMMARIZE or self.summarizer is None:
+            conversation.dropped.clear()
+            return
+        if sum(turn.tokens for turn in conversation.dropped) < CONVERSATION_SUMMARY_TRIGGER:
+            return
+
+        dropped, conversation.dropped = conversation.dropped, []
+
+        async def summarize() -> None:
+            turns = [{"role": turn.role, "content": turn.content} for turn in dropped]
+            try:
+                summary = await self.summarizer(conversation.summary, turns)
+            except Exception as e:
+                print(f"Error summarising conversation: {e}")
+                return
+            if summary:
+                conversation.summary = summary
+
+        task = asyncio.create_task(summarize())
+        self._summarizing.add(task)
+        task.add_done_callback(self._summarizing.discard)
+
+    def stats(self) -> Dict[str, int]:
+        return self._conversations.stats()
+
+
+conversations = ConversationStore()
@@ -0,0 +1,217 @@
+"""
+End-to-end deadlines and hedging for external calls.
+A user request gets one deadline when its job starts. It lives in a
+context variable, which asyncio copies into every task the request
+spawns, so the image fetch, Groq, geocode and weather calls underneath
+all see it. Each call asks budget() for its timeout: its own cap, cut
+down to whatever is left of the request's time. Idempotent GETs go
+through hedged(), which races a second copy once the first is slower
+than a high percentile of recent calls and cancels whichever loses.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, Optional, TypeVar
+
+import metrics
+
+# How long a user waits for an answer, from their message to the last external call
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "30"))
+# Hedge a GET once it's slower than this percentile of recent calls to the same API
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+# Samples needed before the percentile is trusted; until then nothing is hedged
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", "200"))
+# Which APIs may be hedged (comma separated; empty disables GET hedging)
+HTTP_HEDGE = {name.strip() for name in os.getenv("HTTP_HEDGE", "image,geocode,weather").split(",") if name.strip()}
+
+T = TypeVar("T")
+
+deadlines_exceeded = metrics.Counter("bot_deadline_exceeded_total", "Calls abandoned because the request ran out of time", ("call",))
+http_hedges = metrics.Counter("bot_http_hedges_total", "Hedged GET requests started, by API", ("call",))
+
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """
+    Raised when a request has no time left for a call.
+    """
+
+
+@contextmanager
+def request_deadline(seconds: float) -> Iterator[None]:
+    """
+    Give everything in the block at most this many more seconds.
+    A deadline inside another can only shorten it.
+    """
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def detached() -> Iterator[None]:
+    """
+    Run the block without the request's deadline, e.g. background work it kicks off.
+    """
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """
+    Seconds left before the current request's deadline, or None without one.
+    """
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def budget(cap: Optional[float], call: str = "call") -> Optional[float]:
+    """
+    The timeout for a child call: cap, or less if the request has less time left.
+
+    Raises:
+        DeadlineExceeded: If the request has no time left.
+    """
+    left = remaining()
+    if left is None:
+        return cap
+    if left <= 0:
+        deadlines_exceeded.inc(call=call)
+        raise DeadlineExceeded(f"no time left for {call}")
+    return left if cap is None else min(cap, left)
+
+
+class LatencyWindow:
+    """
+    The most recent latencies of one kind of call, for percentile-based hedging.
+    """
+
+    def __init__(self, size: int = LATENCY_WINDOW) -> None:
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, p: float = HEDGE_PERCENTILE, min_samples: int = HEDGE_MIN_SAMPLES) -> Optional[float]:
+        if len(self.samples) < max(1, min_samples):
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+_windows: Dict[str, LatencyWindow] = {}
+
+
+async def hedged(name: str, call: Callable[[], Awaitable[T]], cap: Optional[float] = None) -> T:
+    """
+    Run an idempotent call within the request's deadline, starting a second
+    copy if the first is slower than HEDGE_PERCENTILE of recent calls to the
+    same API. The first success wins and the other copy is cancelled; errors
+    aren't retried, only slowness is.
+
+    Raises:
+        DeadlineExceeded: If no copy finished before the deadline (or cap).
+    """
+    window = _windows.get(name)
+    if window is None:
+        window = _windows[name] = LatencyWindow()
+    delay = window.percentile() if name in HTTP_HEDGE else None
+    timeout = budget(cap, name)
+    stop_at = None if timeout is None else time.monotonic() + timeout
+
+    pending: Dict[asyncio.Future, float] = {}
+
+    def launch() -> None:
+        pending[asyncio.ensure_future(call())] = time.perf_counter()
+
+    launch()
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            wait = None if stop_at is None else stop_at - time.monotonic()
+            if delay is not None:
+                wait = delay if wait is None else min(wait, delay)
+            done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if delay is not None and (stop_at is None or time.monotonic() < stop_at):
+                    delay = None
+                    http_hedges.inc(call=name)
+                    launch()
+                    continue
+                deadlines_exceeded.inc(call=name)
+                raise DeadlineExceeded(f"{name} didn't finish in time")
+            for task in done:
+                started = pending.pop(task)
+                if task.exception() is None:
+                    window.observe(time.perf_counter() - started)
+                    return task.result()
+                error = task.exception()
+        assert error is not None
+        raise error
+    finally:
+        for task, started in pending.items():
+            # A loser or abandoned call took at least this long
+            window.observe(time.perf_counter() - started)
+            task.cancel()
+
+
+async def shared_within(future: "asyncio.Future[T]", call: str = "call") -> T:
+    """
+    Wait for a task shared between requests (started under detached()) until
+    this request's deadline; giving up leaves the task running for the others.
+
+    Raises:
+        DeadlineExceeded: If the deadline passes first.
+    """
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), budget(None, call))
+    except asyncio.TimeoutError as e:
+        if isinstance(e, DeadlineExceeded):
+            raise
+        deadlines_exceeded.inc(call=call)
+        raise DeadlineExceeded(f"{call} didn't finish in time") from e
+
+
+async def until_deadline(stream: AsyncIterator[T], call: str = "stream") -> AsyncIterator[T]:
+    """
+    Pass items through from an async iterator until the request's deadline.
+
+    Raises:
+        DeadlineExceeded: If the deadline passes while waiting for the next item.
+    """
+    iterator = stream.__aiter__()
+    while True:
+        try:
+            item = await asyncio.wait_for(iterator.__anext__(), budget(None, call))
+        except StopAsyncIteration:
+            return
+        except asyncio.TimeoutError as e:
+            if isinstance(e, DeadlineExceeded):
+                raise
+            deadlines_exceeded.inc(call=call)
+            raise DeadlineExceeded(f"{call} didn't finish in time") from e
+        yield item
+
+
+metrics.CallbackGauge(
+    "bot_http_hedge_after_seconds", "Recent GET latency at the hedging percentile, by API", "call",
+    lambda: {name: value for name, window in _windows.items() if (value := window.percentile()) is not None},
+)
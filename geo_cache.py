@@ -0,0 +1,165 @@
+"""
+Persistent geocode cache for the weather agent.
+Coordinates are cached by normalized location name in an in-memory LRU,
+backed by a local SQLite file so they survive restarts. Unknown places
+are cached too (with a shorter TTL) so bad input doesn't keep hitting the API.
+"""
+
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from cache_utils import LRUCache
+
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", "geocode_cache.sqlite3")
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "4096"))
+GEOCODE_CACHE_TTL = float(os.getenv("GEOCODE_CACHE_TTL", str(90 * 24 * 3600)))
+GEOCODE_NEGATIVE_TTL = float(os.getenv("GEOCODE_NEGATIVE_TTL", str(24 * 3600)))
+
+# Stored in place of coordinates for places the geocoder doesn't know
+NOT_FOUND = object()
+
+_MISSING = object()
+
+
+def normalize_location(location: str) -> str:
+    """
+    Normalize a location description so trivially different spellings share a key.
+    """
+    location = re.sub(r"[^\w\s,]", " ", location.casefold())
+    parts = [" ".join(part.split()) for part in location.split(",")]
+    return ", ".join(part for part in parts if part)
+
+
+class GeocodeCache:
+    """
+    An LRU of coordinates keyed by normalized location, persisted to SQLite.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = GEOCODE_CACHE_PATH,
+        maxsize: int = GEOCODE_CACHE_SIZE,
+        ttl: float = GEOCODE_CACHE_TTL,
+        negative_ttl: float = GEOCODE_NEGATIVE_TTL,
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._memory: LRUCache = LRUCache(maxsize=maxsize)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                " key TEXT PRIMARY KEY, lat REAL, lng REAL, found INTEGER NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _load_rows(self, limit: int) -> list:
+        with self._lock:
+            conn = self._connect()
+            return conn.execute(
+                "SELECT key, lat, lng, found, updated_at FROM geocode"
+                " ORDER BY updated_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+    def _write_row(self, key: str, coords: Optional[Dict[str, float]]) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, lat, lng, found, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (
+                    key,
+                    coords["lat"] if coords else None,
+                    coords["lng"] if coords else None,
+                    1 if coords else 0,
+                    time.time(),
+                ),
+            )
+            conn.commit()
+
+    def _remember(self, key: str, lat: Optional[float], lng: Optional[float], age: float) -> None:
+        ttl = self.ttl if lat is not None else self.negative_ttl
+        remaining = ttl - age
+        if remaining <= 0:
+            return
+        value = {"lat": lat, "lng": lng} if lat is not None else NOT_FOUND
+        self._memory.set(key, value, ttl=remaining)
+
+    async def warm(self) -> int:
+        """
+        Load the most recently used entries from disk into memory.
+
+        Returns:
+            The number of entries loaded.
+        """
+        if not self.path:
+            return 0
+        try:
+            rows = await asyncio.to_thread(self._load_rows, self._memory.maxsize)
+        except sqlite3.Error as e:
+            print(f"Error loading geocode cache: {e}")
+            return 0
+        now = time.time()
+        # Oldest first so the most recent end up at the hot end of the LRU
+        for key, lat, lng, found, updated_at in reversed(rows):
+            self._remember(key, lat if found else None, lng if found else None, now - updated_at)
+        return len(self._memory)
+
+    def get(self, location: str) -> Tuple[bool, Optional[Dict[str, float]]]:
+        """
+        Look up a location.
+
+        Returns:
+            (hit, coords). On a negative hit coords is None.
+        """
+        value = self._memory.get(normalize_location(location), _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        if value is NOT_FOUND:
+            self.negative_hits += 1
+            return True, None
+        return True, dict(value)
+
+    async def set(self, location: str, coords: Optional[Dict[str, float]]) -> None:
+        """
+        Cache coordinates for a location, or None if the place couldn't be found.
+        """
+        key = normalize_location(location)
+        if coords:
+            self._memory.set(key, {"lat": coords["lat"], "lng": coords["lng"]}, ttl=self.ttl)
+        else:
+            self._memory.set(key, NOT_FOUND, ttl=self.negative_ttl)
+        if self.path:
+            try:
+                await asyncio.to_thread(self._write_row, key, coords)
+            except sqlite3.Error as e:
+                print(f"Error writing geocode cache: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "size": len(self._memory),
+        }
+
+
+geocode_cache = GeocodeCache()
@@ -0,0 +1,98 @@
+"""
+Application-scoped HTTP connection pools.
+One aiohttp session (Discord CDN image fetches) and one httpx client
+(geocode / weather APIs) are created at bot startup and closed at shutdown,
+so requests reuse keep-alive connections instead of paying TCP/TLS setup each time.
+"""
+
+import os
+from typing import Optional
+
+import aiohttp
+import httpx
+
+# Pool tuning, overridable from the environment
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+HTTP_DNS_CACHE_SECONDS = int(os.getenv("HTTP_DNS_CACHE_SECONDS", "300"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+
+_session: Optional[aiohttp.ClientSession] = None
+_api_client: Optional[httpx.AsyncClient] = None
+
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    Create a pooled aiohttp session with keep-alive and DNS caching.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_SECONDS,
+        keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=HTTP_CONNECT_TIMEOUT + HTTP_READ_TIMEOUT,
+        connect=HTTP_CONNECT_TIMEOUT,
+        sock_read=HTTP_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+def create_api_client() -> httpx.AsyncClient:
+    """
+    Create a pooled httpx client for the geocode and weather APIs.
+    """
+    limits = httpx.Limits(
+        max_connections=HTTP_POOL_LIMIT,
+        max_keepalive_connections=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+    )
+    timeout = httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+async def start() -> None:
+    """
+    Open the shared pools. Called from the bot's StartingEvent.
+    """
+    global _session, _api_client
+    if _session is None or _session.closed:
+        _session = create_session()
+    if _api_client is None or _api_client.is_closed:
+        _api_client = create_api_client()
+
+
+async def close() -> None:
+    """
+    Close the shared pools. Called from the bot's StoppingEvent.
+    """
+    global _session, _api_client
+    if _session is not None:
+        await _session.close()
+        _session = None
+    if _api_client is not None:
+        await _api_client.aclose()
+        _api_client = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Return the shared aiohttp session, creating it lazily if startup hasn't run.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = create_session()
+    return _session
+
+
+def get_api_client() -> httpx.AsyncClient:
+    """
+    Return the shared httpx client, creating it lazily if startup hasn't run.
+    """
+    global _api_client
+    if _api_client is None or _api_client.is_closed:
+        _api_client = create_api_client()
+    return _api_client
@@ -0,0 +1,265 @@
+"""
+Content-addressed cache of vision-ready images.
+Attachments are downloaded once, downscaled and re-encoded in a process pool,
+and stored as ready-to-send data URIs. Lookups go URL -> content hash -> data URI,
+with an in-memory LRU tier and an optional disk tier (IMAGE_CACHE_DIR).
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import metrics
+from cache_utils import LRUCache
+from deadline import DeadlineExceeded, detached, shared_within
+
+# Pillow is optional (images are then sent as-is) and imported on first use
+_Image: Any = None
+
+# Longest side the vision model gets; larger images are downscaled
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1280"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "256"))
+IMAGE_CACHE_TTL = float(os.getenv("IMAGE_CACHE_TTL", "3600"))
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR")  # Disk tier is disabled when unset
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+
+@dataclass(frozen=True)
+class PreparedImage:
+    content_hash: str
+    data_uri: str
+
+
+# URL key -> content hash, and content hash -> prepared image
+_url_index: LRUCache[str] = LRUCache(maxsize=IMAGE_CACHE_SIZE * 4, ttl=IMAGE_CACHE_TTL)
+_images: LRUCache[PreparedImage] = LRUCache(maxsize=IMAGE_CACHE_SIZE, ttl=IMAGE_CACHE_TTL)
+
+_inflight: Dict[str, "asyncio.Future[Optional[PreparedImage]]"] = {}
+# Requests waiting on each in-flight download; the download is cancelled when the last gives up
+_waiting: Dict[str, int] = {}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def url_key(url: str) -> str:
+    """
+    Normalize an attachment URL to a stable key.
+    Discord signs CDN URLs with expiring query parameters, but the path
+    (channel id / attachment id / filename) identifies the attachment.
+    """
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path}"
+
+
+def _sniff_mime(data: bytes) -> str:
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def _pil() -> Any:
+    global _Image
+    if _Image is None:
+        try:
+            from PIL import Image as _Image
+        except ImportError:
+            _Image = False
+    return _Image or None
+
+
+def prepare_image(data: bytes) -> Tuple[str, str]:
+    """
+    Hash, downscale and re-encode raw image bytes.
+    Runs in a worker process, so it must stay a plain top-level function.
+
+    Returns:
+        (content hash, data URI)
+    """
+    content_hash = hashlib.sha256(data).hexdigest()
+    mime = _sniff_mime(data)
+    encoded = data
+
+    Image = _pil()
+    if Image is not None:
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+                if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+                    # JPEG has no alpha and a plain convert turns transparent areas black;
+                    # flatten onto white, as a viewer would show them
+                    rgba = img.convert("RGBA")
+                    img = Image.new("RGB", rgba.size, (255, 255, 255))
+                    img.paste(rgba, mask=rgba.getchannel("A"))
+                elif img.mode != "RGB":
+                    img = img.convert("RGB")
+                out = io.BytesIO()
+                img.save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+            # Keep the original if re-encoding didn't make it smaller
+            if out.tell() < len(data):
+                encoded = out.getvalue()
+                mime = "image/jpeg"
+        except Exception as e:
+            print(f"Error re-encoding image, sending original: {e}")
+
+    data_uri = f"data:{mime};base64,{base64.b64encode(encoded).decode('utf-8')}"
+    return content_hash, data_uri
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _pool
+
+
+def _has_pil(_: int) -> bool:
+    return _pil() is not None
+
+
+def warm_up() -> None:
+    """
+    Start the image worker processes and import Pillow in each, so the first
+    vision request doesn't pay for it. Blocking; run it in a thread.
+    """
+    list(_get_pool().map(_has_pil, range(IMAGE_WORKERS)))
+
+
+def shutdown() -> None:
+    """
+    Stop the image worker processes. Called when the bot stops.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _disk_path(content_hash: str) -> str:
+    return os.path.join(IMAGE_CACHE_DIR, f"{content_hash}.uri")
+
+
+def _read_disk(content_hash: str) -> Optional[str]:
+    try:
+        with open(_disk_path(content_hash), "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _write_disk(content_hash: str, data_uri: str) -> None:
+    try:
+        os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+        tmp_path = _disk_path(content_hash) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data_uri)
+        os.replace(tmp_path, _disk_path(content_hash))
+    except OSError as e:
+        print(f"Error writing image cache: {e}")
+
+
+async def _lookup_hash(content_hash: str) -> Optional[PreparedImage]:
+    image = _images.get(content_hash)
+    if image is None and IMAGE_CACHE_DIR:
+        data_uri = await asyncio.to_thread(_read_disk, content_hash)
+        if data_uri:
+            image = PreparedImage(content_hash, data_uri)
+            _images.set(content_hash, image)
+    return image
+
+
+async def prepare(data: bytes) -> PreparedImage:
+    """
+    Prepare raw image bytes off the event loop, without caching the result.
+    """
+    loop = asyncio.get_running_loop()
+    with metrics.image_prepare_latency.time():
+        content_hash, data_uri = await loop.run_in_executor(_get_pool(), prepare_image, data)
+    return PreparedImage(content_hash, data_uri)
+
+
+async def adopt(url: str, prepared: PreparedImage) -> PreparedImage:
+    """
+    Cache an already prepared image under url, e.g. one prefetched on message arrival.
+    """
+    image = await _lookup_hash(prepared.content_hash)
+    if image is None:
+        image = prepared
+        _images.set(image.content_hash, image)
+        if IMAGE_CACHE_DIR:
+            await asyncio.to_thread(_write_disk, image.content_hash, image.data_uri)
+    _url_index.set(url_key(url), image.content_hash)
+    return image
+
+
+async def store(url: str, data: bytes) -> PreparedImage:
+    """
+    Prepare raw image bytes off the event loop and cache the result under url.
+    """
+    return await adopt(url, await prepare(data))
+
+
+async def get_cached(url: str) -> Optional[PreparedImage]:
+    """
+    Return the prepared image for url if it has already been processed.
+    """
+    content_hash = _url_index.get(url_key(url))
+    if content_hash is None:
+        return None
+    return await _lookup_hash(content_hash)
+
+
+async def get_image(
+    url: str, fetch: Callable[[str], Awaitable[Optional[bytes]]]
+) -> Optional[PreparedImage]:
+    """
+    Return a vision-ready image for url, downloading and encoding it only on a cache miss.
+    """
+    image = await get_cached(url)
+    if image is not None:
+        return image
+
+    # Concurrent requests for the same attachment share one download
+    key = url_key(url)
+    task = _inflight.get(key)
+    if task is None:
+        # Shared by every caller, so it runs on no one request's deadline; each waits on its own
+        with detached():
+            task = asyncio.ensure_future(_fetch_and_store(url, fetch))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    _waiting[key] = _waiting.get(key, 0) + 1
+    try:
+        return await shared_within(task, "image")
+    except DeadlineExceeded:
+        # As with a failed download, the request goes ahead without the image
+        return None
+    finally:
+        _waiting[key] -= 1
+        if not _waiting[key]:
+            del _waiting[key]
+            if not task.done():
+                task.cancel()
+
+
+async def _fetch_and_store(
+    url: str, fetch: Callable[[str], Awaitable[Optional[bytes]]]
+) -> Optional[PreparedImage]:
+    data = await fetch(url)
+    if not data:
+        return None
+    return await store(url, data)
+
+
+def stats() -> dict:
+    return {"urls": _url_index.stats(), "images": _images.stats()}
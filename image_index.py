@@ -0,0 +1,134 @@
+"""
+In-memory index of recent image attachments, filled from gateway events.
+Maps (channel, user) to that user's latest images so `!vision` can find
+an image without REST history scans. Bounded by entries per user, number
+of tracked (channel, user) pairs and age; deleted messages are removed.
+"""
+
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Iterable, Optional, Tuple
+
+from cache_utils import LRUCache
+
+IMAGE_INDEX_PER_USER = int(os.getenv("IMAGE_INDEX_PER_USER", "5"))
+IMAGE_INDEX_MAX_KEYS = int(os.getenv("IMAGE_INDEX_MAX_KEYS", "20000"))
+# Discord CDN links expire, so old entries aren't worth keeping
+IMAGE_INDEX_MAX_AGE = float(os.getenv("IMAGE_INDEX_MAX_AGE", str(6 * 3600)))
+
+Key = Tuple[int, int]
+
+
+@dataclass(frozen=True)
+class ImageRef:
+    message_id: int
+    url: str
+    seen_at: float
+
+
+def image_urls(message: Any) -> list:
+    """
+    Return the URLs of a message's image attachments.
+    """
+    return [
+        attachment.url
+        for attachment in (message.attachments or ())
+        if attachment.media_type and attachment.media_type.startswith("image/")
+    ]
+
+
+class ImageIndex:
+    """
+    Latest image attachments per (channel, user).
+    """
+
+    def __init__(
+        self,
+        per_user: int = IMAGE_INDEX_PER_USER,
+        max_keys: int = IMAGE_INDEX_MAX_KEYS,
+        max_age: float = IMAGE_INDEX_MAX_AGE,
+    ) -> None:
+        self.per_user = per_user
+        self.max_age = max_age
+        self._images: LRUCache[Deque[ImageRef]] = LRUCache(maxsize=max_keys)
+        # message id -> (channel, user), so deletes can find their entry
+        self._by_message: LRUCache[Key] = LRUCache(maxsize=max_keys * per_user)
+        self.started_at = time.monotonic()
+
+    @property
+    def is_cold(self) -> bool:
+        """
+        True until the bot has been running long enough to have seen every indexable image.
+        """
+        return time.monotonic() - self.started_at < self.max_age
+
+    def add(self, channel_id: int, user_id: int, message_id: int, urls: Iterable[str]) -> None:
+        key = (channel_id, user_id)
+        refs = self._images.get(key)
+        if refs is None:
+            refs = deque()
+        now = time.monotonic()
+        for url in urls:
+            if len(refs) >= self.per_user:
+                dropped = refs.popleft()
+                self._by_message.pop(dropped.message_id)
+            refs.append(ImageRef(message_id, url, now))
+            self._by_message.set(message_id, key)
+        if refs:
+            self._images.set(key, refs)
+
+    def record(self, message: Any) -> list:
+        """
+        Index a message's image attachments, if it has any, and return their URLs.
+        """
+        urls = image_urls(message)
+        if urls:
+            self.add(message.channel_id, message.author.id, message.id, urls)
+        return urls
+
+    def latest(self, channel_id: int, user_id: int) -> Optional[str]:
+        """
+        Return the URL of the user's most recent image in the channel, if still fresh.
+        For a message with several images that's the first one, as the history scan picks.
+        """
+        key = (channel_id, user_id)
+        refs = self._images.get(key)
+        if not refs:
+            return None
+        cutoff = time.monotonic() - self.max_age
+        while refs and refs[0].seen_at < cutoff:
+            self._by_message.pop(refs.popleft().message_id)
+        if not refs:
+            self._images.pop(key)
+            return None
+        newest = refs[-1].message_id
+        url = refs[-1].url
+        for ref in reversed(refs):
+            if ref.message_id != newest:
+                break
+            url = ref.url
+        return url
+
+    def remove(self, message_id: int) -> None:
+        """
+        Forget the images of a deleted message.
+        """
+        key = self._by_message.pop(message_id)
+        if key is None:
+            return
+        refs = self._images.get(key)
+        if not refs:
+            return
+        remaining = deque(ref for ref in refs if ref.message_id != message_id)
+        if remaining:
+            self._images.set(key, remaining)
+        else:
+            self._images.pop(key)
+
+    def stats(self) -> Dict[str, int]:
+        return self._images.stats()
+
+
+image_index = ImageIndex()
@@ -0,0 +1,83 @@
+"""
+Single-pass intent classification for gateway messages.
+Every guild message reaches on_message_create, so messages that don't
+mention the bot are rejected with one membership test. Mentions have the
+mention stripped and are matched once against a precompiled alternation
+of every intent pattern; the winning named group says which intent it
+is, and its subgroups carry the parameters (e.g. weather locations).
+Adding an intent means adding one entry to INTENT_PATTERNS.
+"""
+
+import re
+from typing import Any, NamedTuple, Optional, Sequence, Tuple
+
+# Intents a message can have
+IGNORE = "ignore"
+GREETING = "greeting"
+WEATHER = "weather"
+VISION = "vision"
+CHAT = "chat"
+
+# Text intents, tried together in one regex search; the earliest match wins
+INTENT_PATTERNS = {
+    WEATHER: r"\bweather\s+in\s+(?P<locations>[a-zA-Z\s,]+)",
+}
+
+_INTENTS = re.compile(
+    "|".join(f"(?P<{name}>{pattern})" for name, pattern in INTENT_PATTERNS.items()),
+    re.IGNORECASE,
+)
+
+
+class Intent(NamedTuple):
+    kind: str
+    question: str = ""
+    locations: Tuple[str, ...] = ()
+    image_urls: Tuple[str, ...] = ()
+
+
+_IGNORED = Intent(IGNORE)
+_GREETED = Intent(GREETING)
+
+
+def parse_locations(text: str) -> Tuple[str, ...]:
+    return tuple(location.strip() for location in text.split(",") if location.strip())
+
+
+class IntentRouter:
+    """
+    Classifies messages addressed to the bot. Needs the bot's user id,
+    which is only known once the gateway has connected.
+    """
+
+    def __init__(self) -> None:
+        self.bot_id: Optional[int] = None
+        self._mention = ""
+        self._nick_mention = ""
+
+    def set_bot_id(self, bot_id: int) -> None:
+        self.bot_id = bot_id
+        # Both user (<@id>) and nickname (<@!id>) mention forms; str.replace beats a regex here
+        self._mention = f"<@{bot_id}>"
+        self._nick_mention = f"<@!{bot_id}>"
+
+    def classify(self, message: Any, image_urls: Sequence[str] = ()) -> Intent:
+        """
+        Work out what a message wants in one pass over its content.
+        image_urls are the message's image attachments, already scanned by the caller.
+        """
+        if self.bot_id is None or self.bot_id not in message.user_mentions_ids:
+            return _IGNORED
+        question = (message.content or "").replace(self._mention, "").replace(self._nick_mention, "").strip()
+        if not question:
+            return _GREETED
+
+        match = _INTENTS.search(question)
+        if match is not None and match.lastgroup == WEATHER:
+            locations = parse_locations(match.group("locations"))
+            if locations:
+                return Intent(WEATHER, question, locations)
+        return Intent(VISION if image_urls else CHAT, question, image_urls=tuple(image_urls))
+
+
+intents = IntentRouter()
@@ -0,0 +1,227 @@
+"""
+Job queue between gateway shards and worker processes.
+In the scaled-out deployment, gateway processes only classify events and
+enqueue jobs; workers consume them, call Groq and post replies over REST.
+
+Jobs are partitioned by channel so one channel's requests always land on
+the same worker, keeping its conversation memory and caches together.
+The queue is chosen by JOB_QUEUE_URL:
+
+    (empty) or memory://      in-process asyncio queue (default)
+    redis://host:port/db      Redis lists, shared by processes on any node
+
+Anything speaking the Redis protocol works for the second one, and a
+stand-in client (e.g. fakeredis's FakeRedis) can be passed to RedisQueue.
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Sequence
+
+import metrics
+
+JOB_QUEUE_URL = os.getenv("JOB_QUEUE_URL", "")
+JOB_QUEUE_PARTITIONS = int(os.getenv("JOB_QUEUE_PARTITIONS", "16"))
+JOB_QUEUE_PREFIX = os.getenv("JOB_QUEUE_PREFIX", "groqbot:jobs")
+# Request jobs older than this are dropped; a reply minutes late is worse than none
+JOB_MAX_AGE = float(os.getenv("JOB_MAX_AGE", "120"))
+
+# Kinds that answer a user; the others change settings and are never dropped for their age
+REQUEST_KINDS = ("chat", "weather")
+
+jobs_enqueued = metrics.Counter("bot_jobs_enqueued_total", "Jobs put on the job queue", ("kind",))
+jobs_processed = metrics.Counter("bot_jobs_processed_total", "Jobs handled by workers", ("kind", "status"))
+job_queue_wait = metrics.Histogram("bot_job_queue_wait_seconds", "Time from enqueue to a worker picking the job up")
+
+
+@dataclass
+class Job:
+    """
+    A unit of work for a worker: a chat completion, a weather lookup or a settings change.
+    """
+    kind: str  # "chat", "weather", "forget", "batching" or "responsecache"
+    channel_id: int
+    guild_id: Optional[int]
+    user_id: int
+    payload: Dict[str, Any]
+    priority: int = 1
+    # Settings that apply beyond one channel go to every partition, so every worker sees them
+    broadcast: bool = False
+    # When the user sent the message, for requests; their deadline and the queue's age limit count from it
+    created_at: float = field(default_factory=time.time)
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, data: str) -> "Job":
+        return cls(**json.loads(data))
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.created_at
+
+    @property
+    def is_request(self) -> bool:
+        return self.kind in REQUEST_KINDS
+
+
+def partition_for(channel_id: int, partitions: int = JOB_QUEUE_PARTITIONS) -> int:
+    return channel_id % partitions
+
+
+def partitions_for_job(job: Job, partitions: int = JOB_QUEUE_PARTITIONS) -> List[int]:
+    """
+    The partitions a job is put on: its channel's, or all of them for a broadcast.
+    """
+    if job.broadcast:
+        return list(range(partitions))
+    return [partition_for(job.channel_id, partitions)]
+
+
+def partitions_for_worker(index: int, count: int, partitions: int = JOB_QUEUE_PARTITIONS) -> List[int]:
+    """
+    The partitions worker `index` of `count` consumes.
+    """
+    return [p for p in range(partitions) if p % count == index]
+
+
+class JobQueue(ABC):
+    """
+    Base class for job queue backends.
+    """
+
+    partitions = JOB_QUEUE_PARTITIONS
+
+    @abstractmethod
+    async def put(self, job: Job) -> None:
+        """
+        Enqueue a job on its channel's partition (every partition for a broadcast).
+        """
+
+    @abstractmethod
+    async def get(self, partitions: Sequence[int], timeout: Optional[float] = None) -> Optional[Job]:
+        """
+        Wait for the next job from any of the given partitions; None on timeout.
+        """
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class InProcessQueue(JobQueue):
+    """
+    Per-partition deques in this process, for a gateway running its own workers.
+    """
+
+    def __init__(self, partitions: int = JOB_QUEUE_PARTITIONS) -> None:
+        self.partitions = partitions
+        self._queues: List[Deque[str]] = [deque() for _ in range(partitions)]
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _cond(self) -> asyncio.Condition:
+        # Created lazily so the queue can be built before the event loop starts
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def put(self, job: Job) -> None:
+        condition = self._cond()
+        data = job.to_json()
+        async with condition:
+            for partition in partitions_for_job(job, self.partitions):
+                self._queues[partition].append(data)
+            condition.notify_all()
+        jobs_enqueued.inc(kind=job.kind)
+
+    def _pop(self, partitions: Sequence[int]) -> Optional[str]:
+        for partition in partitions:
+            if self._queues[partition]:
+                return self._queues[partition].popleft()
+        return None
+
+    async def get(self, partitions: Sequence[int], timeout: Optional[float] = None) -> Optional[Job]:
+        condition = self._cond()
+        async with condition:
+            try:
+                await asyncio.wait_for(
+                    condition.wait_for(lambda: any(self._queues[p] for p in partitions)), timeout
+                )
+            except asyncio.TimeoutError:
+                return None
+            return Job.from_json(self._pop(partitions))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "depth": sum(len(queue) for queue in self._queues)}
+
+
+class RedisQueue(JobQueue):
+    """
+    One Redis list per partition; workers block on all of theirs at once with BLPOP.
+    Delivery is at most once: a worker that dies mid-job loses that job.
+    """
+
+    def __init__(
+        self,
+        url: str = JOB_QUEUE_URL,
+        partitions: int = JOB_QUEUE_PARTITIONS,
+        prefix: str = JOB_QUEUE_PREFIX,
+        client: Any = None,
+    ) -> None:
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError as e:
+                raise RuntimeError("JOB_QUEUE_URL points at Redis: install the redis package") from e
+            client = redis.from_url(url, decode_responses=True)
+        self._redis = client
+        self.partitions = partitions
+        self.prefix = prefix
+
+    def _key(self, partition: int) -> str:
+        return f"{self.prefix}:{partition}"
+
+    async def put(self, job: Job) -> None:
+        data = job.to_json()
+        for partition in partitions_for_job(job, self.partitions):
+            await self._redis.rpush(self._key(partition), data)
+        jobs_enqueued.inc(kind=job.kind)
+
+    async def get(self, partitions: Sequence[int], timeout: Optional[float] = None) -> Optional[Job]:
+        # BLPOP treats 0 as "wait forever"
+        result = await self._redis.blpop([self._key(p) for p in partitions], timeout=timeout or 0)
+        if result is None:
+            return None
+        _, data = result
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        return Job.from_json(data)
+
+    async def close(self) -> None:
+        close = getattr(self._redis, "aclose", None) or getattr(self._redis, "close", None)
+        if close is not None:
+            await close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "redis", "prefix": self.prefix}
+
+
+def create_queue(url: str = JOB_QUEUE_URL, partitions: int = JOB_QUEUE_PARTITIONS) -> JobQueue:
+    """
+    Build the queue backend named by url.
+    """
+    if not url or url.startswith("memory://"):
+        return InProcessQueue(partitions)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisQueue(url, partitions)
+    raise ValueError(f"Unsupported JOB_QUEUE_URL: {url}")
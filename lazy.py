@@ -0,0 +1,86 @@
+"""
+Deferred imports for heavy subsystems.
+A LazyModule is imported on first attribute access, or ahead of time by
+warm_up() in a background thread once the gateway is connected, so
+pydantic-ai, logfire and friends never sit on the startup path.
+"""
+
+import asyncio
+import importlib
+import threading
+import time
+from types import ModuleType
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+
+# Seconds each lazily loaded module took to import (or warm-up step took to run)
+load_times: Dict[str, float] = {}
+
+
+class LazyModule:
+    """
+    Stands in for a module until something uses it.
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module: Optional[ModuleType] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def load(self) -> ModuleType:
+        if self._module is None:
+            # Warm-up imports in a thread; the lock makes a concurrent first use wait for it
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    self._module = importlib.import_module(self._name)
+                    load_times[self._name] = time.perf_counter() - started
+        return self._module
+
+    async def aload(self) -> ModuleType:
+        """
+        load() for async callers: a first use during warm-up waits for the
+        import in a thread instead of blocking the event loop on the lock.
+        """
+        if self._module is None:
+            await asyncio.to_thread(self.load)
+        assert self._module is not None
+        return self._module
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.load(), attr)
+
+    def __repr__(self) -> str:
+        return f"<LazyModule {self._name} ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+async def warm_up(*steps: Callable[[], Any]) -> None:
+    """
+    Run blocking initialisation steps (e.g. LazyModule.load) one after
+    another in a worker thread, so they don't stall the event loop.
+    Failures are logged; the subsystem then initialises on first use instead.
+    """
+    started = time.perf_counter()
+    for step in steps:
+        owner = getattr(step, "__self__", None)
+        name = owner._name if isinstance(owner, LazyModule) else getattr(step, "__qualname__", repr(step))
+        step_started = time.perf_counter()
+        try:
+            await asyncio.to_thread(step)
+        except Exception as e:
+            print(f"Warm-up step {name} failed: {e}")
+            continue
+        # LazyModule.load records its own import time
+        load_times.setdefault(name, time.perf_counter() - step_started)
+    print(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+
+metrics.CallbackGauge(
+    "bot_lazy_load_seconds", "Time taken to import or initialise a deferred subsystem", "module",
+    lambda: dict(load_times),
+)
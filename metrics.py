@@ -0,0 +1,265 @@
+"""
+Lightweight in-process metrics with a Prometheus text endpoint.
+Counters and histograms are plain Python objects updated on the hot path;
+`/metrics` renders them (plus cache statistics collected on demand) in the
+Prometheus exposition format. A sampling profiler can be switched on at
+runtime to see where the event loop spends its time.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 disables the endpoint
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    A monotonically increasing counter with optional labels.
+    """
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self._values: Dict[LabelValues, float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    A cumulative-bucket histogram with optional labels.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self.buckets = buckets
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += counts[-1]
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            plain = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{plain} {self._sums[key]}")
+            lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+
+class CallbackGauge:
+    """
+    A gauge whose values are read from a callback when metrics are scraped.
+    The callback returns {label value: number} for a single label.
+    """
+
+    def __init__(self, name: str, help_text: str, label: str, callback: Callable[[], Dict[str, float]]) -> None:
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.callback = callback
+        REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {e}")
+            return lines
+        for label_value, value in values.items():
+            lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+
+REGISTRY: list = []
+
+
+def render() -> str:
+    """
+    Render every registered metric in the Prometheus text format.
+    """
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Hot-path metrics
+gateway_events = Counter("bot_gateway_events_total", "Gateway message events received", ("kind",))
+gateway_lag = Histogram("bot_gateway_lag_seconds", "Time from message creation to handler start")
+commands = Counter("bot_commands_total", "Requests handled by command", ("command",))
+typing_latency = Histogram("bot_discord_typing_seconds", "Time to trigger the typing indicator")
+discord_send_latency = Histogram("bot_discord_send_seconds", "Time to send or edit a Discord message")
+image_fetch_latency = Histogram("bot_image_fetch_seconds", "Time to download an image attachment")
+image_prepare_latency = Histogram("bot_image_prepare_seconds", "Time to downscale and encode an image")
+groq_queue_wait = Histogram("bot_groq_queue_wait_seconds", "Time waiting for a Groq scheduler slot")
+groq_first_token = Histogram("bot_groq_first_token_seconds", "Time to first streamed token", ("model",))
+groq_latency = Histogram("bot_groq_request_seconds", "Total Groq request time", ("model",))
+groq_requests = Counter("bot_groq_requests_total", "Groq requests by outcome", ("model", "status"))
+groq_rate_limited = Counter("bot_groq_rate_limited_total", "Groq 429 responses")
+requests_shed = Counter("bot_requests_shed_total", "Requests rejected by the scheduler", ("reason",))
+tool_latency = Histogram("bot_tool_call_seconds", "Weather tool call time", ("tool",))
+startup_seconds = Histogram(
+    "bot_startup_seconds", "Time from importing the bot to gateway ready", buckets=(0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0, 60.0)
+)
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the stack of one thread (the event loop) and counts
+    where it is. Sampling runs in a background thread, so overhead is a
+    few microseconds per sample.
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._target: Optional[int] = None
+        self.samples: _Counter = _Counter()
+        self.total = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, thread_id: Optional[int] = None) -> None:
+        if self.running:
+            return
+        self._target = thread_id or threading.get_ident()
+        self.samples.clear()
+        self.total = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < 12:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+            self.total += 1
+
+    def report(self, top: int = 10) -> str:
+        """
+        Summarise the most common leaf functions, with their share of samples.
+        """
+        if not self.total:
+            return "No samples collected."
+        leaves: _Counter = _Counter()
+        for stack, count in self.samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        lines = [f"{self.total} samples every {self.interval * 1000:.0f}ms"]
+        for leaf, count in leaves.most_common(top):
+            lines.append(f"{count / self.total:6.1%}  {leaf}")
+        return "\n".join(lines)
+
+
+profiler = SamplingProfiler()
+
+_runner = None
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> None:
+    """
+    Serve /metrics on a local port.
+    """
+    global _runner
+    if not port or _runner is not None:
+        return
+    from aiohttp import web
+
+    async def handle_metrics(request: "web.Request") -> "web.Response":
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+
+
+async def stop_server() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,157 @@
+"""
+Live catalog of the models Groq currently serves.
+The models endpoint is fetched at startup and refreshed in the background
+every MODEL_CATALOG_TTL seconds, so `!models` and model validation never
+wait on the network. Context windows from the catalog feed conversation
+budgeting, and models Groq no longer lists are dropped from routing.
+
+Groq doesn't report image support, so vision capability is inferred from
+the model id (MODEL_VISION_PATTERN) or listed in MODEL_VISION_IDS.
+"""
+
+import asyncio
+import difflib
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from conversation import MODEL_CONTEXT_WINDOWS
+from router import router
+
+MODEL_CATALOG_TTL = float(os.getenv("MODEL_CATALOG_TTL", "3600"))
+# Retry sooner when a refresh fails
+MODEL_CATALOG_RETRY = float(os.getenv("MODEL_CATALOG_RETRY", "60"))
+MODEL_VISION_PATTERN = re.compile(os.getenv("MODEL_VISION_PATTERN", r"vision|llava|llama-4-(scout|maverick)"), re.IGNORECASE)
+MODEL_VISION_IDS = {model.strip() for model in os.getenv("MODEL_VISION_IDS", "").split(",") if model.strip()}
+# Speech, guard and other non-chat models aren't offered for !groq and !vision
+_NON_CHAT_MODEL = re.compile(r"whisper|tts|guard|distil", re.IGNORECASE)
+
+
+@dataclass
+class ModelInfo:
+    id: str
+    owned_by: str = ""
+    context_window: Optional[int] = None
+    max_completion_tokens: Optional[int] = None
+    vision: bool = False
+
+
+class ModelCatalog:
+    """
+    The last known model list. Empty until the first successful fetch, in
+    which case nothing is rejected and routing uses its configured models.
+    """
+
+    def __init__(self, ttl: float = MODEL_CATALOG_TTL) -> None:
+        self.ttl = ttl
+        self.models: Dict[str, ModelInfo] = {}
+        self.fetched_at: Optional[float] = None
+        self.refreshes = 0
+        self.failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self.models)
+
+    def _parse(self, raw: Any) -> Optional[ModelInfo]:
+        model_id = getattr(raw, "id", None)
+        if not model_id or getattr(raw, "active", True) is False or _NON_CHAT_MODEL.search(model_id):
+            return None
+        return ModelInfo(
+            id=model_id,
+            owned_by=getattr(raw, "owned_by", "") or "",
+            context_window=getattr(raw, "context_window", None),
+            max_completion_tokens=getattr(raw, "max_completion_tokens", None),
+            vision=model_id in MODEL_VISION_IDS or bool(MODEL_VISION_PATTERN.search(model_id)),
+        )
+
+    async def refresh(self, client: Any) -> int:
+        """
+        Fetch the model list and swap it in. Returns the number of chat models.
+        """
+        response = await client.models.list()
+        models = {}
+        for raw in response.data:
+            info = self._parse(raw)
+            if info is not None:
+                models[info.id] = info
+        if not models:
+            raise ValueError("Groq returned no chat models")
+
+        self.models = models
+        self.fetched_at = time.time()
+        self.refreshes += 1
+        MODEL_CONTEXT_WINDOWS.update({m.id: m.context_window for m in models.values() if m.context_window})
+        router.set_available(models)
+        return len(models)
+
+    async def _refresh_forever(self, client: Any) -> None:
+        while True:
+            try:
+                count = await self.refresh(client)
+                print(f"Model catalog refreshed: {count} models")
+                delay = self.ttl
+            except Exception as e:
+                self.failures += 1
+                print(f"Error refreshing model catalog: {e}")
+                delay = MODEL_CATALOG_RETRY
+            await asyncio.sleep(delay)
+
+    def start(self, client: Any) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_forever(client))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get(self, model: str) -> Optional[ModelInfo]:
+        return self.models.get(model)
+
+    def validate(self, model: str, vision: bool = False) -> Optional[str]:
+        """
+        Check a user-supplied model name. Returns an error message, or None if it's usable.
+        """
+        if not self.loaded:
+            return None
+        info = self.models.get(model)
+        if info is None:
+            close = difflib.get_close_matches(model, list(self.models), n=3, cutoff=0.5)
+            hint = f" Did you mean {', '.join(f'`{m}`' for m in close)}?" if close else ""
+            return f"`{model}` isn't a model Groq currently serves.{hint} See `!models`."
+        if vision and not info.vision:
+            return f"`{model}` can't read images. See `!models` for vision models."
+        return None
+
+    def describe(self) -> List[str]:
+        """
+        One line per model, text models first, for `!models`.
+        """
+        def line(info: ModelInfo) -> str:
+            context = f"{info.context_window // 1024}k context" if info.context_window else "context unknown"
+            owner = f", {info.owned_by}" if info.owned_by else ""
+            return f"- {info.id} ({context}{owner})"
+
+        models = sorted(self.models.values(), key=lambda m: m.id)
+        lines = ["Text Models:"] + [line(m) for m in models if not m.vision]
+        lines += ["", "Vision Models:"] + [line(m) for m in models if m.vision]
+        return lines
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "models": len(self.models),
+            "age": round(time.time() - self.fetched_at) if self.fetched_at else None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
+
+
+model_catalog = ModelCatalog()
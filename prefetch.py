@@ -0,0 +1,184 @@
+"""
+Speculative prefetch of image attachments.
+In opted-in channels, every message with images starts a background
+download and downscale as soon as it arrives, before anyone knows whether
+the bot will be asked about it. Results wait in a short-lived buffer
+capped in bytes, oldest evicted first. A vision request then starts with
+the image ready, or joins its download if still in flight, and moves it
+into the image cache. Unused prefetches simply expire.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, NamedTuple, Optional, Set
+
+import image_cache
+import metrics
+from image_cache import PreparedImage, url_key
+
+# Channel ids to prefetch in (comma separated), "all" for every channel; empty turns prefetch off
+IMAGE_PREFETCH_CHANNELS = os.getenv("IMAGE_PREFETCH_CHANNELS", "")
+IMAGE_PREFETCH_CONCURRENCY = int(os.getenv("IMAGE_PREFETCH_CONCURRENCY", "4"))
+# Prefetches queued or running at most; images arriving beyond that aren't prefetched
+IMAGE_PREFETCH_MAX_PENDING = int(os.getenv("IMAGE_PREFETCH_MAX_PENDING", "32"))
+IMAGE_PREFETCH_MAX_BYTES = int(os.getenv("IMAGE_PREFETCH_MAX_BYTES", str(64 * 1024 * 1024)))
+IMAGE_PREFETCH_TTL = float(os.getenv("IMAGE_PREFETCH_TTL", "300"))
+
+Fetch = Callable[[str], Awaitable[Optional[bytes]]]
+
+image_prefetches = metrics.Counter(
+    "bot_image_prefetch_total", "Speculative image prefetches by outcome", ("result",)
+)
+
+
+def parse_channels(value: str) -> Optional[Set[int]]:
+    """
+    The configured channel ids, or None for all channels.
+    """
+    if value.strip().lower() == "all":
+        return None
+    return {int(channel) for channel in value.split(",") if channel.strip()}
+
+
+class _Buffered(NamedTuple):
+    image: PreparedImage
+    size: int
+    expires_at: float
+
+
+class ImagePrefetcher:
+    """
+    Bounded-concurrency prefetch into a byte-capped, oldest-first buffer.
+    """
+
+    def __init__(
+        self,
+        channels: str = IMAGE_PREFETCH_CHANNELS,
+        concurrency: int = IMAGE_PREFETCH_CONCURRENCY,
+        max_pending: int = IMAGE_PREFETCH_MAX_PENDING,
+        max_bytes: int = IMAGE_PREFETCH_MAX_BYTES,
+        ttl: float = IMAGE_PREFETCH_TTL,
+    ) -> None:
+        self.enabled = bool(channels.strip())
+        self.channels = parse_channels(channels) if self.enabled else set()
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self._buffer: "OrderedDict[str, _Buffered]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._started: Set[str] = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def enabled_for(self, channel_id: int) -> bool:
+        return self.enabled and (self.channels is None or channel_id in self.channels)
+
+    def prefetch(self, channel_id: int, urls: Iterable[str], fetch: Fetch) -> None:
+        """
+        Start fetching and preparing a message's images in the background.
+        Returns immediately; does nothing outside the configured channels.
+        """
+        if not self.enabled_for(channel_id):
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        for url in urls:
+            key = url_key(url)
+            if key in self._buffer or key in self._pending:
+                continue
+            if len(self._pending) >= self.max_pending:
+                image_prefetches.inc(result="skipped")
+                continue
+            task = asyncio.create_task(self._fetch(key, url, fetch))
+            self._pending[key] = task
+            task.add_done_callback(lambda _, key=key: self._done(key))
+            image_prefetches.inc(result="started")
+
+    def _done(self, key: str) -> None:
+        self._pending.pop(key, None)
+        self._started.discard(key)
+
+    async def _fetch(self, key: str, url: str, fetch: Fetch) -> None:
+        assert self._semaphore is not None
+        async with self._semaphore:
+            self._started.add(key)
+            if await image_cache.get_cached(url) is not None:
+                return
+            data = await fetch(url)
+            if not data:
+                return
+            try:
+                image = await image_cache.prepare(data)
+            except Exception as e:
+                print(f"Error preparing prefetched image: {e}")
+                return
+        self._put(key, image)
+
+    def _put(self, key: str, image: PreparedImage) -> None:
+        size = len(image.data_uri)
+        if size > self.max_bytes:
+            return
+        self._buffer[key] = _Buffered(image, size, time.monotonic() + self.ttl)
+        self.bytes += size
+        self._evict()
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        # Entries are in arrival order, so expired and over-budget ones are all at the front
+        while self._buffer:
+            key, entry = next(iter(self._buffer.items()))
+            if entry.expires_at > now and self.bytes <= self.max_bytes:
+                break
+            del self._buffer[key]
+            self.bytes -= entry.size
+            image_prefetches.inc(result="expired" if entry.expires_at <= now else "evicted")
+
+    def _take(self, key: str) -> Optional[PreparedImage]:
+        self._evict()
+        entry = self._buffer.pop(key, None)
+        if entry is None:
+            return None
+        self.bytes -= entry.size
+        return entry.image
+
+    async def get_image(self, url: str, fetch: Fetch) -> Optional[PreparedImage]:
+        """
+        Return a vision-ready image for url: from the prefetch buffer, from a
+        prefetch already downloading it, or else from the image cache.
+        """
+        key = url_key(url)
+        task = self._pending.get(key)
+        if task is not None:
+            if key in self._started:
+                # Already downloading; joining it beats starting over
+                try:
+                    await asyncio.shield(task)
+                except Exception:
+                    pass
+            else:
+                # Still queued behind other prefetches; fetch directly instead
+                task.cancel()
+        image = self._take(key)
+        if image is not None:
+            image_prefetches.inc(result="hit")
+            return await image_cache.adopt(url, image)
+        return await image_cache.get_image(url, fetch)
+
+    def stats(self) -> Dict[str, int]:
+        self._evict()
+        return {
+            "buffered": len(self._buffer),
+            "bytes": self.bytes,
+            "pending": len(self._pending),
+        }
+
+
+prefetcher = ImagePrefetcher()
+
+metrics.CallbackGauge(
+    "bot_image_prefetch_buffer", "Prefetched images waiting to be used", "state",
+    lambda: prefetcher.stats(),
+)
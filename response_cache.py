@@ -0,0 +1,173 @@
+"""
+Response cache in front of Groq completions.
+The exact tier is keyed on model, normalized prompt, image hashes and
+sampling parameters. The optional semantic tier embeds text-only prompts
+with a small local model and returns a cached answer when a previous
+prompt is similar enough (cosine similarity over a NumPy matrix).
+Caching only applies when the sampling temperature is low enough, and
+guilds can opt out.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from cache_utils import LRUCache
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "21600"))
+# Responses sampled above this temperature are too varied to reuse. The bot samples at 0.7,
+# so by default nothing is cached: replaying one sample to everyone who asks is opt-in
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", "0.3"))
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_EMBEDDING_MODEL = os.getenv("RESPONSE_CACHE_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+RESPONSE_CACHE_SEMANTIC_SIZE = int(os.getenv("RESPONSE_CACHE_SEMANTIC_SIZE", "4096"))
+RESPONSE_CACHE_OPTOUT_GUILDS = {
+    int(guild_id) for guild_id in os.getenv("RESPONSE_CACHE_OPTOUT_GUILDS", "").split(",") if guild_id.strip()
+}
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Normalize case, whitespace and trailing punctuation so trivially different prompts match.
+    """
+    prompt = " ".join(prompt.casefold().split())
+    return re.sub(r"[\s?!.]+$", "", prompt)
+
+
+class SemanticIndex:
+    """
+    A fixed-size ring of unit-normalized prompt embeddings searched with one matrix product.
+    """
+
+    def __init__(self, model_name: str, capacity: int, threshold: float, ttl: float) -> None:
+        self.model_name = model_name
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self._model: Any = None
+        self._np: Any = None
+        self._vectors: Any = None
+        self._responses: List[Optional[str]] = [None] * capacity
+        self._models: List[Optional[str]] = [None] * capacity
+        self._expires = [0.0] * capacity
+        self._next = 0
+        self._lock = asyncio.Lock()
+        self.available = True
+
+    def _load(self) -> bool:
+        if self._model is not None:
+            return True
+        try:
+            import numpy as np
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            print("Semantic response cache disabled: install numpy and sentence-transformers to enable it")
+            self.available = False
+            return False
+        self._np = np
+        self._model = SentenceTransformer(self.model_name)
+        dim = self._model.get_sentence_embedding_dimension()
+        self._vectors = np.zeros((self.capacity, dim), dtype=np.float32)
+        return True
+
+    def _embed(self, text: str) -> Any:
+        if not self._load():
+            return None
+        return self._model.encode(text, normalize_embeddings=True).astype(self._np.float32)
+
+    async def embed(self, text: str) -> Any:
+        if not self.available:
+            return None
+        # Model loading and encoding are CPU-bound; keep them off the event loop
+        async with self._lock:
+            return await asyncio.to_thread(self._embed, text)
+
+    def search(self, vector: Any, model: str) -> Optional[str]:
+        if vector is None or self._vectors is None:
+            return None
+        scores = self._vectors @ vector
+        now = time.monotonic()
+        for index in self._np.argsort(scores)[::-1][:8]:
+            if scores[index] < self.threshold:
+                break
+            if self._models[index] == model and self._expires[index] > now:
+                return self._responses[index]
+        return None
+
+    def add(self, vector: Any, model: str, response: str) -> None:
+        if vector is None or self._vectors is None:
+            return
+        slot = self._next
+        self._vectors[slot] = vector
+        self._responses[slot] = response
+        self._models[slot] = model
+        self._expires[slot] = time.monotonic() + self.ttl
+        self._next = (slot + 1) % self.capacity
+
+
+class ResponseCache:
+    """
+    Exact and (optionally) semantic cache of completed responses.
+    """
+
+    def __init__(self) -> None:
+        self._exact: LRUCache[str] = LRUCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+        self._semantic: Optional[SemanticIndex] = None
+        if RESPONSE_CACHE_SEMANTIC:
+            self._semantic = SemanticIndex(
+                RESPONSE_CACHE_EMBEDDING_MODEL,
+                RESPONSE_CACHE_SEMANTIC_SIZE,
+                RESPONSE_CACHE_SIMILARITY,
+                RESPONSE_CACHE_TTL,
+            )
+        self.opted_out: Set[int] = set(RESPONSE_CACHE_OPTOUT_GUILDS)
+        self.semantic_hits = 0
+
+    def enabled_for(self, guild_id: Optional[int], temperature: float) -> bool:
+        return temperature <= RESPONSE_CACHE_MAX_TEMPERATURE and guild_id not in self.opted_out
+
+    def set_guild_enabled(self, guild_id: int, enabled: bool) -> None:
+        if enabled:
+            self.opted_out.discard(guild_id)
+        else:
+            self.opted_out.add(guild_id)
+
+    def key(self, model: str, prompt: str, image_hashes: List[str], params: Dict[str, Any]) -> str:
+        payload = json.dumps(
+            [model, normalize_prompt(prompt), sorted(image_hashes), params],
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def lookup(self, key: str, model: str, prompt: str, has_images: bool) -> Optional[str]:
+        """
+        Return a cached response for the exact key, or a semantically similar text prompt.
+        """
+        response = self._exact.get(key)
+        if response is not None or self._semantic is None or has_images:
+            return response
+        vector = await self._semantic.embed(normalize_prompt(prompt))
+        response = self._semantic.search(vector, model)
+        if response is not None:
+            self.semantic_hits += 1
+            # Promote to the exact tier so the next identical prompt skips embedding
+            self._exact.set(key, response)
+        return response
+
+    async def store(self, key: str, model: str, prompt: str, has_images: bool, response: str) -> None:
+        self._exact.set(key, response)
+        if self._semantic is not None and not has_images:
+            vector = await self._semantic.embed(normalize_prompt(prompt))
+            self._semantic.add(vector, model, response)
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._exact.stats(), "semantic_hits": self.semantic_hits}
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,303 @@
+"""
+Model routing and failover for Groq requests.
+A cheap local classifier picks a tier for each prompt: the vision models
+when images are attached, a small fast model for short simple prompts and
+the large model otherwise. Within a tier, models are ordered by their live
+latency (an EWMA per model), skipping any cooling down after a rate limit
+or server error. Calls fail over to the next model on 429, 5xx or timeout,
+and a hedged request to the next model starts once the first one is slower
+than a high percentile of that model's recent calls. Attempts only get what
+is left of the request's deadline, and no new attempt starts once it passes.
+"""
+
+import asyncio
+import os
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, TypeVar
+
+import metrics
+from deadline import DeadlineExceeded, LatencyWindow, budget, deadlines_exceeded, expired, remaining
+from scheduler import parse_reset
+
+
+def _models(name: str, default: str) -> List[str]:
+    return [model.strip() for model in os.getenv(name, default).split(",") if model.strip()]
+
+
+# Candidate models per tier, in order of preference until latencies are known
+ROUTER_SMALL_MODELS = _models("ROUTER_SMALL_MODELS", "llama-3.1-8b-instant,gemma2-9b-it")
+ROUTER_LARGE_MODELS = _models("ROUTER_LARGE_MODELS", "llama-3.3-70b-versatile,llama3-70b-8192")
+ROUTER_VISION_MODELS = _models(
+    "ROUTER_VISION_MODELS",
+    "meta-llama/llama-4-scout-17b-16e-instruct,meta-llama/llama-4-maverick-17b-128e-instruct",
+)
+# Send short, simple prompts to the small tier (false: always use the large tier)
+ROUTER_CLASSIFY = os.getenv("ROUTER_CLASSIFY", "true").lower() in ("1", "true", "yes")
+ROUTER_SIMPLE_MAX_CHARS = int(os.getenv("ROUTER_SIMPLE_MAX_CHARS", "280"))
+ROUTER_MAX_ATTEMPTS = int(os.getenv("ROUTER_MAX_ATTEMPTS", "3"))
+ROUTER_ATTEMPT_TIMEOUT = float(os.getenv("ROUTER_ATTEMPT_TIMEOUT", "30"))
+# Hedge once a call is slower than this percentile of the model's recent calls. Until there
+# are enough samples, hedge at ROUTER_HEDGE_FACTOR times its usual latency (or ROUTER_HEDGE_AFTER)
+ROUTER_HEDGE_PERCENTILE = float(os.getenv("ROUTER_HEDGE_PERCENTILE", "95"))
+ROUTER_HEDGE_FACTOR = float(os.getenv("ROUTER_HEDGE_FACTOR", "2.5"))
+ROUTER_HEDGE_AFTER = float(os.getenv("ROUTER_HEDGE_AFTER", "3"))
+ROUTER_HEDGE_MIN = float(os.getenv("ROUTER_HEDGE_MIN", "0.5"))
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", "0.3"))
+# How long a model is skipped after a 429 without retry-after, or a server error
+ROUTER_COOLDOWN = float(os.getenv("ROUTER_COOLDOWN", "15"))
+
+# Words that suggest a prompt needs the large model's reasoning
+_COMPLEX_PROMPT = re.compile(
+    r"\b(explain|why|how (?:do|does|can|would|should)|compare|analy[sz]e|write|code|debug|implement|"
+    r"prove|step[- ]by[- ]step|essay|summari[sz]e|translate|plan|design|refactor|calculate)\b|```",
+    re.IGNORECASE,
+)
+
+T = TypeVar("T")
+
+router_routes = metrics.Counter("bot_router_routes_total", "Prompts routed by tier", ("tier",))
+router_failovers = metrics.Counter("bot_router_failovers_total", "Failed model attempts that were failed over", ("model",))
+router_hedges = metrics.Counter("bot_router_hedges_total", "Hedged requests started, by hedge model", ("model",))
+
+
+def classify(prompt: str, has_images: bool = False) -> str:
+    """
+    Pick a tier from cheap features of the request: attachments, length and keywords.
+    """
+    if has_images:
+        return "vision"
+    if (
+        ROUTER_CLASSIFY
+        and len(prompt) <= ROUTER_SIMPLE_MAX_CHARS
+        and prompt.count("\n") < 3
+        and not _COMPLEX_PROMPT.search(prompt)
+    ):
+        return "small"
+    return "large"
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Whether another model might succeed: rate limits, server errors and timeouts.
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = status_code(error)
+    if status is not None:
+        return status in (408, 429) or status >= 500
+    # e.g. groq.APITimeoutError and APIConnectionError carry no status
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name
+
+
+class ModelRouter:
+    """
+    Orders candidate models by live latency and runs calls with failover and hedging.
+    Latency is tracked per model and kind of call ("stream" is time to first
+    token, "complete" and "agent" are whole calls), since they aren't comparable.
+    """
+
+    def __init__(
+        self,
+        tiers: Dict[str, List[str]],
+        alpha: float = ROUTER_EWMA_ALPHA,
+        max_attempts: int = ROUTER_MAX_ATTEMPTS,
+    ) -> None:
+        self.tiers = tiers
+        self.alpha = alpha
+        self.max_attempts = max_attempts
+        self.latency: Dict[Tuple[str, str], float] = {}
+        self.windows: Dict[Tuple[str, str], LatencyWindow] = {}
+        self.available: Optional[Set[str]] = None
+        self._cooldown_until: Dict[str, float] = {}
+
+    def set_available(self, models: Iterable[str]) -> None:
+        """
+        Limit routing to models Groq currently serves (from the model catalog).
+        """
+        self.available = set(models)
+
+    def observe(self, model: str, seconds: float, kind: str = "complete") -> None:
+        key = (model, kind)
+        previous = self.latency.get(key)
+        self.latency[key] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = LatencyWindow()
+        window.observe(seconds)
+
+    def cool_down(self, model: str, seconds: float = ROUTER_COOLDOWN) -> None:
+        self._cooldown_until[model] = max(self._cooldown_until.get(model, 0.0), time.monotonic() + seconds)
+
+    def record_failure(self, model: str, error: BaseException, elapsed: float, kind: str = "complete") -> None:
+        status = status_code(error)
+        if status == 429:
+            response = getattr(error, "response", None)
+            headers = getattr(response, "headers", None) or {}
+            self.cool_down(model, parse_reset(headers.get("retry-after")) or ROUTER_COOLDOWN)
+        elif status is not None and status >= 500:
+            self.cool_down(model)
+        elif is_retryable(error):
+            # Timeouts count as very slow answers, so traffic drifts away from the model
+            self.observe(model, elapsed, kind)
+
+    def candidates(self, tier: str, kind: str = "complete") -> List[str]:
+        """
+        The tier's models, fastest first. Untried models sort first so each gets
+        measured; models cooling down go last but remain as a last resort.
+        """
+        now = time.monotonic()
+        models = self.tiers.get(tier) or self.tiers["large"]
+        if self.available is not None:
+            # Decommissioned models are skipped, unless none of the tier is left
+            models = [model for model in models if model in self.available] or models
+        return sorted(models, key=lambda model: (
+            self._cooldown_until.get(model, 0.0) > now,
+            self.latency.get((model, kind), 0.0),
+            models.index(model),
+        ))
+
+    def route(
+        self, prompt: str, has_images: bool = False, requested: Optional[str] = None, kind: str = "complete"
+    ) -> Tuple[str, List[str]]:
+        """
+        Choose the models to try for a request, in order.
+        A model the user asked for is the only candidate, so it's never
+        hedged or failed over to a model they didn't choose.
+        Returns the tier name and the candidate models.
+        """
+        tier = classify(prompt, has_images)
+        if requested:
+            tier = next((name for name, models in self.tiers.items() if requested in models), tier)
+            models = [requested]
+        else:
+            models = self.candidates(tier, kind)
+            router_routes.inc(tier=tier)
+        return tier, models
+
+    def hedge_delay(self, model: str, kind: str = "complete") -> float:
+        window = self.windows.get((model, kind))
+        tail = window.percentile(ROUTER_HEDGE_PERCENTILE) if window is not None else None
+        if tail is not None:
+            return max(ROUTER_HEDGE_MIN, tail)
+        latency = self.latency.get((model, kind))
+        if latency is None:
+            return ROUTER_HEDGE_AFTER
+        return max(ROUTER_HEDGE_MIN, latency * ROUTER_HEDGE_FACTOR)
+
+    async def run(
+        self,
+        models: Sequence[str],
+        call: Callable[[str], Awaitable[T]],
+        kind: str = "complete",
+        timeout: float = ROUTER_ATTEMPT_TIMEOUT,
+        discard: Optional[Callable[[T], Any]] = None,
+        hedge: bool = True,
+    ) -> Tuple[T, str]:
+        """
+        Call models in order until one succeeds, failing over on retryable
+        errors and hedging with the next model when a call runs long.
+        Each attempt is limited to timeout or the request's remaining time.
+        Results of hedges that finish after the winner are passed to discard.
+        Calls too costly to duplicate (e.g. agent runs with tools) pass hedge=False.
+
+        Returns:
+            The first successful result and the model that produced it.
+
+        Raises:
+            DeadlineExceeded: If the request's deadline passed before any model answered.
+        """
+        models = list(models)[:max(1, self.max_attempts)]
+        pending: Dict[asyncio.Task, Tuple[str, float]] = {}
+        next_index = 0
+        last_error: Optional[BaseException] = None
+
+        def launch() -> str:
+            nonlocal next_index
+            model = models[next_index]
+            next_index += 1
+            task = asyncio.ensure_future(asyncio.wait_for(call(model), budget(timeout, kind)))
+            pending[task] = (model, time.perf_counter())
+            return model
+
+        latest = launch()
+        try:
+            while pending:
+                can_hedge = hedge and next_index < len(models)
+                wait = self.hedge_delay(latest, kind) if can_hedge else None
+                left = remaining()
+                if left is not None:
+                    wait = left if wait is None else min(wait, left)
+                done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if expired():
+                        # The user has stopped waiting; the finally block cancels what's in flight
+                        deadlines_exceeded.inc(call=kind)
+                        raise DeadlineExceeded(f"no model answered the {kind} call in time")
+                    # Slower than this model usually is: race the next one
+                    latest = launch()
+                    router_hedges.inc(model=latest)
+                    continue
+
+                winner: Optional[Tuple[T, str]] = None
+                for task in done:
+                    model, started = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        if winner is None:
+                            self.observe(model, time.perf_counter() - started, kind)
+                            winner = (task.result(), model)
+                        elif discard is not None:
+                            discard(task.result())
+                        continue
+                    last_error = error
+                    self.record_failure(model, error, time.perf_counter() - started, kind)
+                    if not is_retryable(error):
+                        raise error
+                    router_failovers.inc(model=model)
+                if winner is not None:
+                    return winner
+                if not pending and next_index < len(models) and not expired():
+                    latest = launch()
+            assert last_error is not None
+            raise last_error
+        finally:
+            for task, (model, started) in pending.items():
+                # A hedge loser took at least this long; without it a slow model would look untried
+                elapsed = time.perf_counter() - started
+                if elapsed > self.latency.get((model, kind), 0.0):
+                    self.observe(model, elapsed, kind)
+                task.cancel()
+                if discard is not None:
+                    task.add_done_callback(lambda t: discard(t.result()) if not t.cancelled() and t.exception() is None else None)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "latency": {f"{model}/{kind}": round(value, 3) for (model, kind), value in self.latency.items()},
+            "cooling_down": [model for model, until in self._cooldown_until.items() if until > now],
+            "unavailable": [
+                model for models in self.tiers.values() for model in models
+                if self.available is not None and model not in self.available
+            ],
+        }
+
+
+router = ModelRouter({
+    "small": ROUTER_SMALL_MODELS,
+    "large": ROUTER_LARGE_MODELS,
+    "vision": ROUTER_VISION_MODELS,
+})
+
+metrics.CallbackGauge(
+    "bot_router_latency_ewma_seconds", "Smoothed latency by model and call kind", "model",
+    lambda: {f"{model}/{kind}": value for (model, kind), value in router.latency.items()},
+)
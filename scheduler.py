@@ -0,0 +1,254 @@
+"""
+Admission control and priority scheduling for Groq requests.
+Requests are rate limited per user and per guild with token buckets,
+run under a global concurrency limit, and wait in a bounded priority
+queue (commands ahead of casual mentions). When the queue is full or a
+caller is over its limit the request is shed with SchedulerBusy so the
+handler can reply immediately. Groq's x-ratelimit-* headers are used to
+pause dispatch before the account limit is hit.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import AsyncIterator, List, Mapping, Optional, Tuple
+
+import metrics
+from cache_utils import LRUCache
+from deadline import remaining
+
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "8"))
+GROQ_MAX_QUEUE = int(os.getenv("GROQ_MAX_QUEUE", "32"))
+GROQ_QUEUE_TIMEOUT = float(os.getenv("GROQ_QUEUE_TIMEOUT", "20"))
+# Requests per minute and burst size for each user and each guild
+USER_RATE_PER_MINUTE = float(os.getenv("USER_RATE_PER_MINUTE", "6"))
+USER_BURST = float(os.getenv("USER_BURST", "3"))
+GUILD_RATE_PER_MINUTE = float(os.getenv("GUILD_RATE_PER_MINUTE", "60"))
+GUILD_BURST = float(os.getenv("GUILD_BURST", "10"))
+# Stop dispatching when this few requests/tokens remain in Groq's window
+GROQ_RESERVE_REQUESTS = int(os.getenv("GROQ_RESERVE_REQUESTS", "2"))
+GROQ_RESERVE_TOKENS = int(os.getenv("GROQ_RESERVE_TOKENS", "2000"))
+
+BUSY_MESSAGE = "I'm handling a lot of questions right now. Please try again in a moment."
+
+
+class Priority(IntEnum):
+    """Lower values are dispatched first."""
+    COMMAND = 0
+    MENTION = 1
+
+
+class SchedulerBusy(Exception):
+    """Raised when a request is shed instead of queued."""
+
+
+class TokenBucket:
+    """
+    A classic token bucket refilled continuously at `rate` tokens per second.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_take(self, amount: float = 1.0) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """
+    Parse Groq's reset durations such as "7.66s", "2m59.56s" or "120ms" into seconds.
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _int_header(headers: Mapping[str, str], name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class GroqScheduler:
+    """
+    Gatekeeper between the Discord handlers and Groq.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = GROQ_MAX_CONCURRENCY,
+        max_queue: int = GROQ_MAX_QUEUE,
+        queue_timeout: float = GROQ_QUEUE_TIMEOUT,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._user_buckets: LRUCache[TokenBucket] = LRUCache(maxsize=10000)
+        self._guild_buckets: LRUCache[TokenBucket] = LRUCache(maxsize=10000)
+        self._paused_until = 0.0
+        self.shed = 0
+        self.dispatched = 0
+
+    def _bucket(self, buckets: LRUCache, key: int, per_minute: float, burst: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(per_minute / 60.0, burst)
+            buckets.set(key, bucket)
+        return bucket
+
+    def _admit(self, user_id: Optional[int], guild_id: Optional[int]) -> None:
+        if user_id is not None:
+            bucket = self._bucket(self._user_buckets, user_id, USER_RATE_PER_MINUTE, USER_BURST)
+            if not bucket.try_take():
+                raise SchedulerBusy("user rate limit")
+        if guild_id is not None:
+            bucket = self._bucket(self._guild_buckets, guild_id, GUILD_RATE_PER_MINUTE, GUILD_BURST)
+            if not bucket.try_take():
+                raise SchedulerBusy("guild rate limit")
+
+    def _max_wait(self) -> float:
+        # Never queue past the request's deadline; the answer would be thrown away
+        left = remaining()
+        return self.queue_timeout if left is None else min(self.queue_timeout, left)
+
+    async def _acquire(self, priority: Priority) -> None:
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise SchedulerBusy("queue full")
+        max_wait = self._max_wait()
+        if max_wait <= 0:
+            raise SchedulerBusy("deadline")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (int(priority), next(self._seq), future)
+        heapq.heappush(self._waiters, entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), max_wait)
+        except asyncio.TimeoutError:
+            self._give_up(entry)
+            raise SchedulerBusy("queue timeout")
+        except asyncio.CancelledError:
+            self._give_up(entry)
+            raise
+
+    def _give_up(self, entry: Tuple[int, int, asyncio.Future]) -> None:
+        future = entry[2]
+        if future.done() and not future.cancelled():
+            # The slot was handed over just as we gave up; pass it on
+            self._release()
+            return
+        future.cancel()
+        # Leaving the entry behind would count it against max_queue and block the fast path
+        try:
+            self._waiters.remove(entry)
+        except ValueError:
+            return
+        heapq.heapify(self._waiters)
+
+    def _release(self) -> None:
+        # Hand the slot straight to the highest-priority live waiter
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    async def _respect_upstream_limits(self) -> None:
+        delay = self._paused_until - time.monotonic()
+        if delay <= 0:
+            return
+        if delay > self._max_wait():
+            raise SchedulerBusy("upstream rate limit")
+        await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        priority: Priority,
+        user_id: Optional[int] = None,
+        guild_id: Optional[int] = None,
+    ) -> AsyncIterator[None]:
+        """
+        Hold one Groq concurrency slot for the duration of the block.
+
+        Raises:
+            SchedulerBusy: If the request is rate limited or the queue is full.
+        """
+        started = time.perf_counter()
+        try:
+            self._admit(user_id, guild_id)
+            await self._acquire(priority)
+        except SchedulerBusy as e:
+            self.shed += 1
+            metrics.requests_shed.inc(reason=str(e))
+            raise
+        metrics.groq_queue_wait.observe(time.perf_counter() - started)
+        try:
+            await self._respect_upstream_limits()
+            self.dispatched += 1
+            yield
+        finally:
+            self._release()
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """
+        Pause dispatch when Groq reports the rate limit window is nearly used up.
+        """
+        pause = 0.0
+        retry_after = parse_reset(headers.get("retry-after"))
+        if retry_after:
+            pause = max(pause, retry_after)
+
+        remaining_requests = _int_header(headers, "x-ratelimit-remaining-requests")
+        if remaining_requests is not None and remaining_requests <= GROQ_RESERVE_REQUESTS:
+            pause = max(pause, parse_reset(headers.get("x-ratelimit-reset-requests")) or 0.0)
+
+        remaining_tokens = _int_header(headers, "x-ratelimit-remaining-tokens")
+        if remaining_tokens is not None and remaining_tokens <= GROQ_RESERVE_TOKENS:
+            pause = max(pause, parse_reset(headers.get("x-ratelimit-reset-tokens")) or 0.0)
+
+        if pause > 0:
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "queued": len(self._waiters),
+            "dispatched": self.dispatched,
+            "shed": self.shed,
+        }
+
+
+scheduler = GroqScheduler()
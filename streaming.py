@@ -0,0 +1,324 @@
+"""
+Discord output stage for LLM responses.
+Streamed output is buffered and flushed to a single message by editing it
+every few tokens or milliseconds, rolling over to a new message at the 2000
+char limit. Complete responses are sent as plain messages, packed into
+embeds (up to 4000 chars each) or, when very long, as a file attachment.
+Text is split on paragraph, code-fence and sentence boundaries, and code
+blocks cut between messages are closed and reopened so they still render.
+Message creates are paced per channel to stay inside Discord's rate limit
+bucket instead of running into 429s.
+"""
+
+import asyncio
+import os
+import re
+import time
+from typing import Any, Awaitable, Callable, List, Optional
+
+import hikari
+
+import metrics
+from cache_utils import LRUCache
+from scheduler import TokenBucket
+
+# Discord's hard limit on message content length
+DISCORD_MESSAGE_LIMIT = 2000
+# Discord's limits on embeds: 4096 chars per description, 6000 chars and 10 embeds per message
+DISCORD_EMBED_TOTAL_LIMIT = 6000
+DISCORD_EMBEDS_PER_MESSAGE = 10
+
+# The in-progress message is edited once at least this many tokens are new and at least
+# this long has passed since the last edit; Discord rate limits edits to about one a second
+STREAM_EDIT_EVERY_TOKENS = int(os.getenv("STREAM_EDIT_EVERY_TOKENS", "24"))
+STREAM_EDIT_INTERVAL_MS = int(os.getenv("STREAM_EDIT_INTERVAL_MS", "1000"))
+
+# Complete responses longer than one message go out as embeds of up to this many chars
+REPLY_EMBEDS = os.getenv("REPLY_EMBEDS", "true").lower() in ("1", "true", "yes")
+EMBED_CHAR_LIMIT = min(4096, int(os.getenv("EMBED_CHAR_LIMIT", "4000")))
+# Responses longer than this are attached as a file, with the start shown as a preview
+FILE_ATTACHMENT_THRESHOLD = int(os.getenv("FILE_ATTACHMENT_THRESHOLD", "12000"))
+FILE_PREVIEW_CHARS = int(os.getenv("FILE_PREVIEW_CHARS", "1500"))
+
+# Message creates per channel: Discord allows a burst of 5, refilling about one a second
+CHANNEL_SEND_BURST = float(os.getenv("CHANNEL_SEND_BURST", "5"))
+CHANNEL_SENDS_PER_SECOND = float(os.getenv("CHANNEL_SENDS_PER_SECOND", "1"))
+
+# Shown at the end of a message that is still being written
+TYPING_SUFFIX = " ▌"
+# Shown at the end of a reply whose stream failed partway
+INTERRUPTED_NOTICE = "\n\n*(response interrupted)*"
+
+_FENCE_LINE = re.compile(r"^[ \t]*(```|~~~)(.*)$", re.MULTILINE)
+_FENCE_CLOSE = "\n```"
+_SENTENCE_END = re.compile(r"[.!?。！？][\"')\]]*\s")
+
+Send = Callable[..., Awaitable[Any]]
+
+
+def open_fence(text: str) -> Optional[str]:
+    """
+    The opening line (e.g. "```python") of a code block left open at the end of text, if any.
+    """
+    opening = None
+    for match in _FENCE_LINE.finditer(text):
+        if opening is None:
+            opening = match.group(0).strip()
+        elif not match.group(2).strip():
+            opening = None
+    return opening
+
+
+def _split_point(text: str, limit: int) -> int:
+    """
+    Find where to cut text so the first part fits in limit, preferring a paragraph
+    break, then a line break, then the end of a sentence, then whitespace.
+    """
+    if len(text) <= limit:
+        return len(text)
+    floor = limit // 2
+    cut = text.rfind("\n\n", 0, limit)
+    if cut < floor:
+        cut = text.rfind("\n", 0, limit)
+    if cut < floor and open_fence(text[:limit]) is None:
+        # Sentences only count outside code, where a '.' is usually syntax
+        ends = [m.end() - 1 for m in _SENTENCE_END.finditer(text, floor, limit + 1)]
+        cut = ends[-1] if ends else -1
+    if cut < floor:
+        cut = text.rfind(" ", 0, limit)
+    if cut < floor:
+        cut = limit
+    return cut
+
+
+def split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT) -> List[str]:
+    """
+    Split text into chunks of at most limit chars on natural boundaries,
+    closing code blocks at the end of a chunk and reopening them in the next.
+    """
+    chunks: List[str] = []
+    reopen = ""
+    while text:
+        budget = limit - len(reopen)
+        if len(text) <= budget:
+            chunks.append(reopen + text)
+            break
+        cut = _split_point(text, budget - len(_FENCE_CLOSE))
+        chunk = reopen + text[:cut]
+        fence = open_fence(chunk)
+        if fence is not None:
+            chunks.append(chunk.rstrip() + _FENCE_CLOSE)
+            # An absurdly long info string isn't worth repeating in every chunk
+            reopen = (fence if len(fence) <= limit // 8 else fence[:3]) + "\n"
+            # Keep indentation inside code; only drop the newline we cut at
+            text = text[cut:].lstrip("\n")
+        else:
+            chunks.append(chunk.rstrip())
+            reopen = ""
+            text = text[cut:].lstrip()
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+class ChannelPacer:
+    """
+    Per-channel token buckets for message creates, so a long answer (or several
+    answers in one busy channel) queues locally instead of collecting 429s.
+    """
+
+    def __init__(
+        self,
+        rate: float = CHANNEL_SENDS_PER_SECOND,
+        burst: float = CHANNEL_SEND_BURST,
+        max_channels: int = 10000,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._buckets = LRUCache(max_channels)
+        self.waits = 0
+
+    async def wait(self, channel_id: Optional[int]) -> None:
+        if channel_id is None or self.rate <= 0:
+            return
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets.set(channel_id, bucket)
+        while not bucket.try_take():
+            self.waits += 1
+            await asyncio.sleep((1.0 - bucket.tokens) / bucket.rate)
+
+
+pacer = ChannelPacer()
+
+
+class StreamingReply:
+    """
+    A reply that grows as tokens arrive.
+
+    `send` posts a new message and returns an object with an async `edit(content)`
+    method, e.g. `event.message.respond` or `ctx.respond`. With a channel_id,
+    new messages are paced per channel.
+    """
+
+    def __init__(
+        self,
+        send: Send,
+        edit_every_tokens: int = STREAM_EDIT_EVERY_TOKENS,
+        edit_interval_ms: int = STREAM_EDIT_INTERVAL_MS,
+        channel_id: Optional[int] = None,
+    ) -> None:
+        self._send = send
+        self._edit_every_tokens = max(1, edit_every_tokens)
+        self._edit_interval = max(0, edit_interval_ms) / 1000
+        self._channel_id = channel_id
+        self._message: Any = None
+        self._current = ""  # Text of the message currently being edited
+        self._shown = ""  # What Discord shows for the current message
+        self._pending_tokens = 0
+        self._last_flush = 0.0
+        self.messages: List[Any] = []
+        self.text = ""
+
+    async def _publish(self, content: str) -> None:
+        if self._message is None:
+            await pacer.wait(self._channel_id)
+            with metrics.discord_send_latency.time():
+                self._message = await self._send(content)
+            self.messages.append(self._message)
+        elif content != self._shown:
+            with metrics.discord_send_latency.time():
+                await self._message.edit(content)
+        self._shown = content
+        self._pending_tokens = 0
+        self._last_flush = time.monotonic()
+
+    async def feed(self, token: str) -> None:
+        """
+        Append a token and flush to Discord once enough tokens have accumulated
+        and the minimum gap between edits has passed.
+        """
+        if not token:
+            return
+        self.text += token
+        self._current += token
+        self._pending_tokens += 1
+
+        # Roll over to a new message once the current one is full, leaving room to close a code block
+        limit = DISCORD_MESSAGE_LIMIT - len(TYPING_SUFFIX) - len(_FENCE_CLOSE)
+        while len(self._current) > limit:
+            cut = _split_point(self._current, limit)
+            head, rest = self._current[:cut], self._current[cut:]
+            fence = open_fence(head)
+            if fence is not None:
+                await self._publish(head.rstrip() + _FENCE_CLOSE)
+                self._current = fence + "\n" + rest.lstrip("\n")
+            else:
+                await self._publish(head)
+                self._current = rest.lstrip()
+            self._message = None
+            self._shown = ""
+
+        if not self._current.strip():
+            return
+
+        # The first token is shown immediately to minimise time-to-first-text; after that
+        # the interval is a floor, so fast streams can't outrun Discord's edit rate limit
+        first = self._message is None
+        due = (
+            self._pending_tokens >= self._edit_every_tokens
+            and time.monotonic() - self._last_flush >= self._edit_interval
+        )
+        if first or due:
+            # Close a code block that is still being written so the message renders
+            closing = _FENCE_CLOSE if open_fence(self._current) is not None else ""
+            await self._publish(self._current + closing + TYPING_SUFFIX)
+
+    async def finish(self, interrupted: bool = False) -> None:
+        """
+        Write the final text of the last message, removing the typing marker.
+        An interrupted reply ends with a notice so it isn't mistaken for a whole answer.
+        """
+        content = ""
+        if self._current.strip():
+            closing = _FENCE_CLOSE if open_fence(self._current) is not None else ""
+            content = self._current + closing
+        notice = INTERRUPTED_NOTICE if interrupted else ""
+        if content and len(content) + len(notice) > DISCORD_MESSAGE_LIMIT:
+            # No room left in this message; the notice goes in a new one
+            await self._publish(content)
+            self._message = None
+            self._shown = ""
+            content = ""
+        if content or notice:
+            await self._publish(content + notice if content else notice.lstrip())
+
+
+def _pack_embeds(chunks: List[str]) -> List[List[str]]:
+    """
+    Group embed descriptions into messages within Discord's per-message embed limits.
+    """
+    messages: List[List[str]] = []
+    for chunk in chunks:
+        last = messages[-1] if messages else None
+        if (
+            last is not None
+            and len(last) < DISCORD_EMBEDS_PER_MESSAGE
+            and sum(map(len, last)) + len(chunk) <= DISCORD_EMBED_TOTAL_LIMIT
+        ):
+            last.append(chunk)
+        else:
+            messages.append([chunk])
+    return messages
+
+
+async def send_text(send: Send, text: str, channel_id: Optional[int] = None) -> List[Any]:
+    """
+    Send an already complete response in as few messages as Discord allows:
+    plain text when it fits one message, embeds when it's longer, and a file
+    attachment with a preview when it's very long. Sends are paced per channel.
+    """
+    # Everything is prepared up front so sends go out back to back
+    if len(text) > FILE_ATTACHMENT_THRESHOLD:
+        preview = split_message(text, FILE_PREVIEW_CHARS)[0]
+        calls = [(
+            f"{preview}\n\n*Full answer attached ({len(text)} characters).*",
+            {"attachment": hikari.Bytes(text.encode("utf-8"), "response.md")},
+        )]
+    elif REPLY_EMBEDS and len(text) > DISCORD_MESSAGE_LIMIT:
+        calls = [
+            (hikari.UNDEFINED, {"embeds": [hikari.Embed(description=chunk) for chunk in group]})
+            for group in _pack_embeds(split_message(text, EMBED_CHAR_LIMIT))
+        ]
+    else:
+        calls = [(chunk, {}) for chunk in split_message(text, DISCORD_MESSAGE_LIMIT)]
+
+    messages = []
+    for content, kwargs in calls:
+        await pacer.wait(channel_id)
+        with metrics.discord_send_latency.time():
+            messages.append(await send(content, **kwargs))
+    return messages
+
+
+class _RestMessage:
+    """
+    A message posted over REST that can be edited like a gateway one.
+    """
+
+    def __init__(self, rest: Any, channel_id: int, message: Any) -> None:
+        self._rest = rest
+        self._channel_id = channel_id
+        self.message = message
+
+    async def edit(self, content: str) -> Any:
+        return await self._rest.edit_message(self._channel_id, self.message, content)
+
+
+def rest_sender(rest: Any, channel_id: int) -> Send:
+    """
+    A `send` callable for StreamingReply and send_text that posts to a channel
+    with a bare REST client, for workers that have no gateway events to reply to.
+    """
+    async def send(content: Any = hikari.UNDEFINED, **kwargs: Any) -> _RestMessage:
+        return _RestMessage(rest, channel_id, await rest.create_message(channel_id, content, **kwargs))
+    return send
@@ -0,0 +1,267 @@
+"""
+Append-only ledger of Groq usage, for capacity planning and per-guild quotas.
+Every model call (and every answer served from the response cache) is
+recorded with its model, prompt and completion tokens, latency and cache
+status, attributed to the guild, user and command of the request it ran
+for. Records are buffered in memory and written to SQLite in batches by a
+background task, so recording never touches the disk on the message path.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import metrics
+
+USAGE_LEDGER_PATH = os.getenv("USAGE_LEDGER_PATH", "usage.sqlite3")  # empty disables the ledger
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "5"))
+# Flush early once this many records are waiting
+USAGE_FLUSH_BATCH = int(os.getenv("USAGE_FLUSH_BATCH", "500"))
+# Records held in memory at most (e.g. while the disk is unwritable); newer ones are dropped
+USAGE_BUFFER_MAX = int(os.getenv("USAGE_BUFFER_MAX", "20000"))
+
+groq_tokens = metrics.Counter("bot_groq_tokens_total", "Groq tokens used, by model and type", ("model", "type"))
+usage_dropped = metrics.Counter("bot_usage_records_dropped_total", "Usage records lost because the buffer was full")
+
+# Who a call is made for; set per request, like the deadline, so deep calls don't need it passed in
+_attribution: ContextVar[Dict[str, Any]] = ContextVar("usage_attribution", default={})
+
+
+class UsageRecord(NamedTuple):
+    ts: float
+    guild_id: Optional[int]
+    user_id: Optional[int]
+    command: str
+    kind: str  # "complete", "stream", "agent" or "cache"
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    latency: float
+    cache: str  # "hit", "miss" or "off"
+
+
+@contextmanager
+def attribute(**fields: Any) -> Iterator[None]:
+    """
+    Attribute usage inside the block to a guild, user, command or cache status.
+    Fields not given are inherited from any enclosing block.
+    """
+    token = _attribution.set({**_attribution.get(), **fields})
+    try:
+        yield
+    finally:
+        _attribution.reset(token)
+
+
+def token_counts(usage: Any) -> Tuple[int, int]:
+    """
+    (prompt, completion) tokens from a Groq usage object or a pydantic-ai Usage.
+    """
+    if usage is None:
+        return 0, 0
+    prompt = getattr(usage, "prompt_tokens", None)
+    if prompt is None:
+        prompt = getattr(usage, "request_tokens", None) or getattr(usage, "input_tokens", None)
+    completion = getattr(usage, "completion_tokens", None)
+    if completion is None:
+        completion = getattr(usage, "response_tokens", None) or getattr(usage, "output_tokens", None)
+    return int(prompt or 0), int(completion or 0)
+
+
+class UsageLedger:
+    """
+    Buffers usage records and flushes them to SQLite from a background task.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = USAGE_LEDGER_PATH,
+        flush_interval: float = USAGE_FLUSH_INTERVAL,
+        flush_batch: int = USAGE_FLUSH_BATCH,
+        buffer_max: int = USAGE_BUFFER_MAX,
+    ) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.buffer_max = buffer_max
+        self._buffer: List[UsageRecord] = []
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+
+    def record(
+        self,
+        model: str,
+        kind: str,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        latency: float = 0.0,
+        cache: Optional[str] = None,
+    ) -> None:
+        """
+        Note one call for the current request. Only appends to memory.
+        """
+        groq_tokens.inc(prompt_tokens, model=model, type="prompt")
+        groq_tokens.inc(completion_tokens, model=model, type="completion")
+        if not self.path:
+            return
+        if len(self._buffer) >= self.buffer_max:
+            self.dropped += 1
+            usage_dropped.inc()
+            return
+        who = _attribution.get()
+        self._buffer.append(UsageRecord(
+            time.time(), who.get("guild_id"), who.get("user_id"), who.get("command", ""),
+            kind, model, prompt_tokens, completion_tokens, latency, cache or who.get("cache", "off"),
+        ))
+        self.recorded += 1
+        if len(self._buffer) >= self.flush_batch and self._wake is not None:
+            self._wake.set()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            # Workers on one host can share the file
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                " ts REAL NOT NULL, guild_id INTEGER, user_id INTEGER, command TEXT NOT NULL,"
+                " kind TEXT NOT NULL, model TEXT NOT NULL, prompt_tokens INTEGER NOT NULL,"
+                " completion_tokens INTEGER NOT NULL, latency REAL NOT NULL, cache TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS usage_guild_ts ON usage (guild_id, ts)")
+            self._conn.commit()
+        return self._conn
+
+    def _write_rows(self, rows: List[UsageRecord]) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.commit()
+
+    async def flush(self) -> int:
+        """
+        Write everything buffered so far in one transaction, off the event loop.
+
+        Returns:
+            The number of records written.
+        """
+        if not self.path or not self._buffer:
+            return 0
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            rows, self._buffer = self._buffer, []
+            try:
+                await asyncio.to_thread(self._write_rows, rows)
+            except sqlite3.Error as e:
+                print(f"Error writing usage ledger: {e}")
+                # Keep them for the next flush, as far as the buffer allows
+                room = max(0, self.buffer_max - len(self._buffer))
+                self._buffer[:0] = rows[len(rows) - room:] if room else []
+                lost = len(rows) - min(room, len(rows))
+                self.dropped += lost
+                usage_dropped.inc(lost)
+                return 0
+            self.written += len(rows)
+            return len(rows)
+
+    async def _run(self) -> None:
+        assert self._wake is not None
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """
+        Start the background flusher. Called from start_services.
+        """
+        if not self.path or (self._task is not None and not self._task.done()):
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the flusher and write whatever is still buffered.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+    def _query_totals(self, guild_id: int, since: float) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._connect()
+            where = "WHERE guild_id = ? AND ts >= ?"
+            total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0),"
+                " COALESCE(AVG(latency), 0), COALESCE(SUM(cache = 'hit'), 0)"
+                f" FROM usage {where}", (guild_id, since),
+            ).fetchone()
+            by_model = conn.execute(
+                "SELECT model, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), AVG(latency)"
+                f" FROM usage {where} AND cache != 'hit' GROUP BY model"
+                " ORDER BY SUM(prompt_tokens + completion_tokens) DESC LIMIT 10", (guild_id, since),
+            ).fetchall()
+            by_command = conn.execute(
+                "SELECT command, COUNT(*), SUM(prompt_tokens + completion_tokens)"
+                f" FROM usage {where} GROUP BY command"
+                " ORDER BY SUM(prompt_tokens + completion_tokens) DESC LIMIT 10", (guild_id, since),
+            ).fetchall()
+        calls, prompt, completion, latency, cache_hits = total
+        return {
+            "calls": calls,
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "avg_latency": latency,
+            "cache_hits": cache_hits,
+            "by_model": by_model,
+            "by_command": by_command,
+        }
+
+    async def totals(self, guild_id: int, days: float = 30) -> Dict[str, Any]:
+        """
+        Usage totals for a guild over the last days, by model and by command.
+        Pending records are flushed first so the answer is current.
+        """
+        await self.flush()
+        return await asyncio.to_thread(self._query_totals, guild_id, time.time() - days * 86400)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "buffered": len(self._buffer),
+        }
+
+
+usage_ledger = UsageLedger()
+
+metrics.CallbackGauge(
+    "bot_usage_ledger", "Usage ledger records by state", "state",
+    lambda: usage_ledger.stats(),
+)
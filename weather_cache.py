@@ -0,0 +1,157 @@
+"""
+Short-lived cache of weather observations.
+Observations are keyed on coordinates snapped to a grid and valid for one
+time bucket. Concurrent misses for the same cell share one upstream request,
+and observations from a previous bucket are served while a background refresh runs.
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from cache_utils import LRUCache
+from deadline import detached, shared_within
+
+# Grid size in degrees (0.05° is roughly 5 km) and freshness window in seconds
+WEATHER_CACHE_GRID = float(os.getenv("WEATHER_CACHE_GRID", "0.05"))
+WEATHER_CACHE_BUCKET = float(os.getenv("WEATHER_CACHE_BUCKET", "600"))
+# How long an observation may be served stale while it is refreshed
+WEATHER_CACHE_STALE = float(os.getenv("WEATHER_CACHE_STALE", "1800"))
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "2048"))
+# Upstream request rate allowed against tomorrow.io
+WEATHER_MAX_RPS = float(os.getenv("WEATHER_MAX_RPS", "3"))
+
+Key = Tuple[float, float]
+
+
+@dataclass
+class _Observation:
+    value: Dict[str, Any]
+    bucket: int
+    fetched_at: float
+
+
+class WeatherCache:
+    """
+    Grid- and time-bucketed weather cache with single-flight fetching.
+    """
+
+    def __init__(
+        self,
+        grid: float = WEATHER_CACHE_GRID,
+        bucket_seconds: float = WEATHER_CACHE_BUCKET,
+        stale_seconds: float = WEATHER_CACHE_STALE,
+        maxsize: int = WEATHER_CACHE_SIZE,
+        max_rps: float = WEATHER_MAX_RPS,
+    ) -> None:
+        self.grid = grid
+        self.bucket_seconds = bucket_seconds
+        self.stale_seconds = stale_seconds
+        self._entries: LRUCache[_Observation] = LRUCache(maxsize=maxsize)
+        self._inflight: Dict[Key, "asyncio.Future[Dict[str, Any]]"] = {}
+        self._refreshing: Set[asyncio.Task] = set()
+        self._min_interval = 1.0 / max_rps if max_rps > 0 else 0.0
+        self._next_slot = 0.0
+        self._rate_lock = asyncio.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_calls = 0
+
+    def key(self, lat: float, lng: float) -> Key:
+        """
+        Snap coordinates to the cache grid.
+        """
+        return (
+            round(round(lat / self.grid) * self.grid, 6),
+            round(round(lng / self.grid) * self.grid, 6),
+        )
+
+    def _bucket(self, now: float) -> int:
+        return int(now // self.bucket_seconds)
+
+    async def _wait_for_rate_limit(self) -> None:
+        # Space upstream calls evenly to stay under the provider's limit
+        async with self._rate_lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self._min_interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _fetch(self, key: Key, fetch: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        await self._wait_for_rate_limit()
+        self.upstream_calls += 1
+        value = await fetch()
+        now = time.time()
+        self._entries.set(key, _Observation(value, self._bucket(now), now))
+        return value
+
+    def _single_flight(
+        self, key: Key, fetch: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> "asyncio.Future[Dict[str, Any]]":
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future
+        # Shared by every caller, so it mustn't inherit (and die with) the first one's deadline
+        with detached():
+            future = asyncio.ensure_future(self._fetch(key, fetch))
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return future
+
+    def _refresh_in_background(self, key: Key, fetch: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+        if key in self._inflight:
+            return
+
+        async def refresh() -> None:
+            try:
+                await self._single_flight(key, fetch)
+            except Exception as e:
+                print(f"Error refreshing weather for {key}: {e}")
+
+        # Outlives the request that noticed the stale entry
+        with detached():
+            task = asyncio.create_task(refresh())
+        self._refreshing.add(task)
+        task.add_done_callback(self._refreshing.discard)
+
+    async def get(
+        self, lat: float, lng: float, fetch: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """
+        Return the observation for a location, calling fetch only when needed.
+        fetch errors propagate to every caller waiting on the same cell.
+        """
+        key = self.key(lat, lng)
+        now = time.time()
+        entry: Optional[_Observation] = self._entries.get(key)
+
+        if entry is not None:
+            if entry.bucket == self._bucket(now):
+                self.hits += 1
+                return dict(entry.value)
+            if now - entry.fetched_at <= self.stale_seconds:
+                self.stale_hits += 1
+                self._refresh_in_background(key, fetch)
+                return dict(entry.value)
+
+        self.misses += 1
+        return dict(await shared_within(self._single_flight(key, fetch), "weather"))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "upstream_calls": self.upstream_calls,
+            "size": len(self._entries),
+        }
+
+
+weather_cache = WeatherCache()
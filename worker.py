@@ -0,0 +1,110 @@
+"""
+Workers for the scaled-out deployment.
+Gateway processes (BOT_MODE=gateway) classify events and put jobs on the
+job queue; workers take them off, call Groq or the weather agent and post
+replies over Discord's REST API. With the in-process queue the gateway
+runs the workers itself; with Redis, start one process per core or node:
+
+    python worker.py --index 0 --count 4
+    python worker.py --index 1 --count 4
+    ...
+
+Each worker consumes its own share of the queue partitions, so a channel's
+jobs (and its conversation memory) always go to the same worker.
+"""
+
+import argparse
+import asyncio
+import os
+from typing import Awaitable, Callable, Optional, Sequence, Set
+
+import metrics
+from job_queue import JOB_MAX_AGE, InProcessQueue, Job, JobQueue, create_queue, job_queue_wait, jobs_processed, partitions_for_worker
+
+# Jobs a worker runs at once; Groq calls are I/O bound, so this can exceed the core count
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "8"))
+
+Handler = Callable[[Job], Awaitable[None]]
+
+
+async def run_workers(
+    queue: JobQueue,
+    handler: Handler,
+    partitions: Sequence[int],
+    concurrency: int = WORKER_CONCURRENCY,
+) -> None:
+    """
+    Take jobs from the given partitions and run them, at most `concurrency` at a time.
+    Runs until cancelled.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    running: Set[asyncio.Task] = set()
+
+    async def run(job: Job) -> None:
+        try:
+            await handler(job)
+            jobs_processed.inc(kind=job.kind, status="ok")
+        except Exception as e:
+            print(f"Error running {job.kind} job {job.id}: {e}")
+            jobs_processed.inc(kind=job.kind, status="error")
+        finally:
+            semaphore.release()
+
+    try:
+        while True:
+            await semaphore.acquire()
+            try:
+                job = await queue.get(partitions)
+            except Exception:
+                semaphore.release()
+                raise
+            if job is None:
+                semaphore.release()
+                continue
+            job_queue_wait.observe(job.age)
+            if job.is_request and job.age > JOB_MAX_AGE:
+                jobs_processed.inc(kind=job.kind, status="expired")
+                semaphore.release()
+                continue
+            task = asyncio.create_task(run(job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    finally:
+        for task in running:
+            task.cancel()
+
+
+async def main(index: int, count: int, concurrency: int, metrics_port: Optional[int]) -> None:
+    import hikari
+
+    # Loads configuration, clients and job handlers; the gateway is never connected
+    import bot
+
+    queue = create_queue()
+    if isinstance(queue, InProcessQueue):
+        raise SystemExit("Worker processes need a shared queue: set JOB_QUEUE_URL (e.g. redis://localhost:6379/0)")
+    partitions = partitions_for_worker(index, count, queue.partitions)
+    rest_app = hikari.RESTApp()
+    await rest_app.start()
+    await bot.start_services(metrics_port)
+    warm_up_task = asyncio.create_task(bot.warm_up_services())
+    print(f"Worker {index}/{count} consuming partitions {partitions} ({queue.stats()['backend']} queue)")
+    try:
+        async with rest_app.acquire(os.getenv("DISCORD_API_KEY"), hikari.TokenType.BOT) as rest:
+            await run_workers(queue, lambda job: bot.handle_job(job, rest), partitions, concurrency)
+    finally:
+        warm_up_task.cancel()
+        await bot.stop_services()
+        await queue.close()
+        await rest_app.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", type=int, default=0, help="This worker's index, from 0")
+    parser.add_argument("--count", type=int, default=1, help="Total number of worker processes")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+    args = parser.parse_args()
+    # Each worker on a node serves metrics on its own port after the gateway's
+    port = metrics.METRICS_PORT + 1 + args.index if metrics.METRICS_PORT else 0
+    asyncio.run(main(args.index, args.count, args.concurrency, port))